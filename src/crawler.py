@@ -10,36 +10,146 @@ Outputs directory of HTML docs containing privacy policies and a txt
 file containing an audit trail of links visited and decisions about those policies.
 """
 
-import argparse, datetime, json, matplotlib, os, pandas as pd, re, signal, sys
+import argparse, datetime, gc, json, os, queue, shutil, signal, socket, sys, threading, time, traceback
+from array import array
 from bs4 import BeautifulSoup
-from multiprocessing import Pool, Value, cpu_count, current_process, Manager
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from utils.utils_reuse import print_progress_bar, request, get_driver, VerifyJsonExtension, myfox
-from verification.verify import get_ground_truth, is_duplicate_policy, is_english, mkdir_clean, strip_text, is_same_webpage
+from collections import Counter
+from multiprocessing import Pool, Value, cpu_count, Manager
+from time import sleep
+from utils.utils import conditional_request, load_render_modes, RenderModes, save_render_modes, print_progress_bar, request, VerifyJsonExtension, myfox, mkdir_clean, MAX_CONTENT_BYTES
+from utils.replay_store import ReplayStore
+from utils.sitemap import discover_sitemap_links
+from utils.work_queue import WorkQueue
+from verification.verify import fingerprint_text, get_ground_truth, ground_truth_similarity, is_duplicate_policy, is_english, prefilter_text, strip_text, is_same_webpage, MIN_POLICY_LENGTH, MIN_POLICY_TERM_DENSITY
+
+# per-link flags, one byte per link in CrawlReturn.flags
+ACCESS = 1          # the link could be fetched and had content
+VALID = 2           # the link is a policy
+DUPLICATE = 4       # the link's text was already seen on another link
+
+def outfile_names(domain, output, outfolders=None):
+    """
+    In:     domain - domain the policy belongs to
+            output - number of the domain's policy output file, 0 if none
+            outfolders - (html, stripped text) folders the file was written
+                         to, this run's folders if None
+    Out:    html and stripped text output file names, "N/A" if none
+    """
+    if output == 0:
+        return "N/A", "N/A"
+    html_folder, stripped_folder = outfolders or (html_outfolder, stripped_outfolder)
+    return (html_folder + domain[:-4] + "_" + str(output) + ".html",
+            stripped_folder + domain[:-4] + "_" + str(output) + ".txt")
 
 class DomainLink():
-    def __init__(self, link, sim_score, html_outfile, stripped_outfile, access_success, valid, duplicate):
-        self.link = link
-        self.sim_score = sim_score
-        self.html_outfile = html_outfile
-        self.stripped_outfile = stripped_outfile
-        self.access_success = access_success
-        self.valid = valid
-        self.duplicate = duplicate
+    """
+    View of one link of a CrawlReturn, built on demand for code that
+    handles links one at a time.  The data itself stays in the
+    CrawlReturn's columns.
+    """
+    __slots__ = ("retobj", "i")
+
+    def __init__(self, retobj, i):
+        self.retobj = retobj
+        self.i = i
+
+    @property
+    def link(self):
+        return self.retobj.links[self.i]
+    @property
+    def sim_score(self):
+        return self.retobj.sim_scores[self.i]
+    @property
+    def access_success(self):
+        return self.retobj.flags[self.i] & ACCESS != 0
+    @property
+    def valid(self):
+        return self.retobj.flags[self.i] & VALID != 0
+    @property
+    def duplicate(self):
+        return self.retobj.flags[self.i] & DUPLICATE != 0
+    @property
+    def output(self):
+        return self.retobj.outputs[self.i]
+    @property
+    def html_outfile(self):
+        return outfile_names(self.retobj.domain, self.output, self.retobj.outfolders)[0]
+    @property
+    def stripped_outfile(self):
+        return outfile_names(self.retobj.domain, self.output, self.retobj.outfolders)[1]
+    @property
+    def fingerprint(self):
+        return self.retobj.policy_meta.get(self.i, (None, None))[0]
+    @property
+    def validators(self):
+        return self.retobj.policy_meta.get(self.i, (None, None))[1]
+    @validators.setter
+    def validators(self, validators):
+        self.retobj.policy_meta[self.i] = (self.fingerprint, validators)
 
 class CrawlReturn():
+    """
+    Result of crawling one domain, sent back from the pool once.  Links are
+    stored column-wise (urls, float scores, flag bytes, output numbers) so
+    a domain pickles to little more than its urls.
+    """
+    __slots__ = ("domain", "access_success", "policy_ground_truth", "find_true_policy",
+                 "reject_counts", "change", "outfolders", "links", "sim_scores", "flags", "outputs", "policy_meta")
+
     def __init__(self, domain, access_success, policy_ground_truth):
         self.domain = domain
-        self.sim_avg = 0.0
-        self.link_list = []
         self.access_success = access_success
         self.policy_ground_truth = policy_ground_truth
         self.find_true_policy = None
-    def add_link(self, link, sim_score, html_outfile, stripped_outfile, access_success, valid, duplicate):
-        link = DomainLink(link, sim_score, html_outfile, stripped_outfile, access_success, valid, duplicate)
-        self.link_list.append(link)
-        self.sim_avg = self.sim_avg + ((sim_score-self.sim_avg)/len(self.link_list))
+        self.reject_counts = {}     # pre-filter rejection reason -> count
+        self.change = None          # incremental mode: new, changed, unchanged or retried
+        self.outfolders = None      # (html, stripped text) folders of a previous run's record, None for this run's
+        self.links = []
+        self.sim_scores = array("d")
+        self.flags = array("B")     # ACCESS | VALID | DUPLICATE
+        self.outputs = array("H")   # output file number, 0 if not written out
+        self.policy_meta = {}       # link position -> (fingerprint, validators) of accepted policies
+    def add_link(self, link, sim_score, output, access_success, valid, duplicate, fingerprint=None, validators=None):
+        if fingerprint is not None:
+            self.policy_meta[len(self.links)] = (fingerprint, validators)
+        self.links.append(link)
+        self.sim_scores.append(sim_score)
+        self.flags.append((ACCESS if access_success else 0) | (VALID if valid else 0) | (DUPLICATE if duplicate else 0))
+        self.outputs.append(output)
+    @property
+    def sim_avg(self):
+        return sum(self.sim_scores) / len(self.sim_scores) if len(self.sim_scores) > 0 else 0.0
+    @property
+    def link_list(self):
+        return [DomainLink(self, i) for i in range(len(self.links))]
+    def num_valid(self):
+        return sum(1 for flags in self.flags if flags & VALID)
+
+def to_record(retobj):
+    """
+    In:     CrawlReturn object
+    Out:    json-serializable dict of the object, as written to results.json
+    """
+    return {"access_success": retobj.access_success,
+            "policy_ground_truth": retobj.policy_ground_truth,
+            "outfolders": list(retobj.outfolders or (html_outfolder, stripped_outfolder)),
+            "links": [{"link": link.link, "sim_score": link.sim_score, "output": link.output,
+                       "access_success": link.access_success, "valid": link.valid, "duplicate": link.duplicate,
+                       "fingerprint": link.fingerprint, "validators": link.validators}
+                      for link in retobj.link_list]}
+
+def from_record(domain, record):
+    """
+    In:     domain - domain the record belongs to
+            record - dict read back from a previous run's results.json
+    Out:    CrawlReturn object rebuilt from the record
+    """
+    retobj = CrawlReturn(domain, record["access_success"], record["policy_ground_truth"])
+    if "outfolders" in record:
+        retobj.outfolders = tuple(record["outfolders"])
+    for link in record["links"]:
+        retobj.add_link(**link)
+    return retobj
 
 def find_keywords(country):
     if country == 'uk':
@@ -63,19 +173,7 @@ def verify(html_contents, ground_truth):
     if not is_english(dictionary, html_contents):
         return 0
     
-    # Create the Document Term Matrix and pandas dataframe
-    # https://www.machinelearningplus.com/nlp/cosine-similarity/
-    documents = [ground_truth, html_contents]
-    count_vectorizer = TfidfVectorizer()
-    sparse_matrix = count_vectorizer.fit_transform(documents)
-    doc_term_matrix = sparse_matrix.todense()
-    df = pd.DataFrame(doc_term_matrix, 
-            columns=count_vectorizer.get_feature_names(),
-            index=["ground_truth", "corp"])
-
-    sim_score = cosine_similarity(df, df)
-
-    return sim_score[0,1]
+    return ground_truth_similarity(ground_truth, html_contents)
 
 def clean_link(link):
     """
@@ -89,7 +187,7 @@ def clean_link(link):
                       
     return link
 
-def find_policy_links(full_url, html, current_links):
+def find_policy_links(full_url, html, current_links, keywords=None):
     """
     @Rui
     Find all the links on the page.  Only returns links which contain some case
@@ -100,12 +198,15 @@ def find_policy_links(full_url, html, current_links):
             soup - BeautifulSoup4 object instantiated with the HTML of the URL
             current_links - [] means that the request was made with HTTP;
                             not [] means the request was made with Selenium
+            keywords - keywords to look for, find_keywords() of the domain's
+                       country if None
     Out:    list of all links on the page
     """
     links = []    
-    index = len(full_url.split('.')) - 1
-    country = full_url.split('.')[index] 
-    keywords = find_keywords(country)
+    if keywords is None:
+        index = len(full_url.split('.')) - 1
+        country = full_url.split('.')[index] 
+        keywords = find_keywords(country)
 
     for kw in keywords:        
         #http request case
@@ -183,13 +284,171 @@ def find_policy_links(full_url, html, current_links):
         
     return links
 
+def find_sitemap_links(full_url):
+    """
+    Look for policy links in the domain's robots.txt and sitemaps before
+    falling back to the landing page.  Links are deduplicated against
+    link_dict the same way find_policy_links() does.
+    In:     full_url - A string representing the full name of the URL
+    Out:    list of new policy links found in the sitemaps
+    """
+    index = len(full_url.split('.')) - 1
+    country = full_url.split('.')[index]
+    links = []
+    for link in discover_sitemap_links(full_url, find_keywords(country)):
+        link = clean_link(link)
+        if link in link_dict:
+            link_dict[link] += 1
+            continue    # we've already visited this link, skip this whole thing
+        link_dict[link] = 0
+        links.append(link)
+    return links
+
+def fetch_landing(domain, rejects):
+    """
+    I/O half of finding a domain's candidate policy links.  Look in the
+    sitemaps first; if they list no policy, fetch the landing page,
+    trying the other url prefixes when "https://www." fails.  A recording
+    crawl fetches the landing page either way, so that replay.py can fall
+    back to it for keyword sets the sitemap links don't match.
+    In:     domain - domain landing page string
+            rejects - Counter tallying why pages were dropped
+    Out:    full_url - url the domain was reached at
+            links - policy links from the sitemaps, [] if none
+            domain_html, all_links - landing page as returned by request(),
+                                     "" and [] if it wasn't fetched or failed
+    """
+    # complete the domain with prefix “https://www.” first 
+    # since “https://www.” covers most cases
+    half_full_url = domain if ("www." in domain) else "www." + domain
+    full_url = half_full_url if ("https" in half_full_url) else "https://" + half_full_url
+
+    # policies listed in the sitemaps need no landing page, fetched or rendered
+    links = [] if skip_sitemaps else find_sitemap_links(full_url)
+    if len(links) > 0 and replay_store is None:
+        return full_url, links, "", []
+    sitemap_url = full_url
+
+    domain_html, all_links = request(full_url, max_content_bytes, rejects, render_modes=render_modes)
+
+    # request failed, try other prefixes to the domain
+    # (an empty domain_html strips to "", no need to parse the page to check)
+    if domain_html =="" and all_links ==[]:
+        full_url = domain if ("http" in domain) else  "http://" + domain       # try "http://"   
+        domain_html, all_links = request(full_url, max_content_bytes, rejects, render_modes=render_modes)
+        
+        if domain_html =="" and all_links ==[]:
+            full_url = domain if ("https" in domain) else  "https://" + domain # try "https://" 
+            domain_html, all_links = request(full_url, max_content_bytes, rejects, render_modes=render_modes)
+
+    if replay_store is not None:
+        accessible = not (domain_html == "" and all_links == [])
+        replay_store.add_domain(domain, full_url if accessible else (sitemap_url if len(links) > 0 else None), links)
+        if accessible:
+            replay_store.add_page(full_url, domain_html, all_links)
+    if len(links) > 0:
+        return sitemap_url, links, "", []
+    return full_url, [], domain_html, all_links
+
+def score_page(full_url, link_html, link_all_links, expand):
+    """
+    CPU half of visiting a candidate link: strip the html, collect the
+    policy links on the page, and score it against the ground truth
+    unless the cheap pre-filters already rule it out.
+    In:     full_url - url the domain was reached at
+            link_html, link_all_links - page as returned by request()
+            expand - whether to look for more policy links on the page
+    Out:    link_contents - stripped text, "" if the page is empty
+            new_links - policy links found on the page
+            sim_score - cosine similarity with the ground truth
+            reject_reason - pre-filter rejection reason, None if scored
+    """
+    link_contents = strip_text(link_html)
+    if link_contents == "":
+        return "", [], 0.0, None
+
+    # add links on this page to the list to be visited if they are new
+    new_links = find_policy_links(full_url, link_html, link_all_links) if expand else []
+
+    # get similarity score, check against the score threshold to see if policy
+    # (obvious non-policies are rejected by cheap checks and never scored)
+    reject_reason = prefilter_text(link_contents, min_policy_length, min_policy_term_density)
+    if reject_reason is None:
+        sim_score = verify(link_contents, ground_truth)
+    else:
+        sim_score = 0.0
+    return link_contents, new_links, sim_score, reject_reason
+
+def needs_render(link_html, link_contents, validators):
+    """
+    Out:    whether a page fetched with plain HTTP stripped to no text at
+            all, so it has to be fetched again with selenium
+    """
+    return link_contents == "" and link_html != "" and not validators.get("rendered")
+
+def write_outfile(outfile, contents):
+    with open(outfile, "w") as fp:
+        fp.write(contents)
+
+def record_link(retobj, link, link_html, link_contents, sim_score, validators, output_count, write=write_outfile):
+    """
+    Decide what a scored, non-empty page is, write it out if it is a new
+    policy, and add it to the domain's stats.
+    In:     retobj - CrawlReturn obj of the domain
+            link, link_html, link_contents, sim_score - the scored page
+            validators - ETag / Last-Modified of the page
+            output_count - number of policies written for the domain so far
+            write - function(outfile, contents) writing an output file
+    Out:    updated output_count
+    """
+    domain = retobj.domain
+    is_policy = sim_score >= cos_sim_threshold
+
+    # if this page is a policy, check duplicate then write out to file
+    if is_policy:
+        if is_duplicate_policy(link_contents, domain, policy_dict):
+            retobj.add_link(link, 0.0, 0, True, True, True)
+            return output_count    # we've already seen this policy, skip
+        output_count += 1
+        html_outfile, stripped_outfile = outfile_names(domain, output_count)
+        write(html_outfile, link_html)
+        write(stripped_outfile, link_contents)
+        retobj.add_link(link, sim_score, output_count, True, True, False, fingerprint_text(link_contents), validators)
+    
+    # this isn't a policy, so just add it to the stats and continue
+    else:
+        if is_duplicate_policy(link_contents, domain, policy_dict):
+            retobj.add_link(link, 0.0, 0, True, False, True)
+            return output_count    # we've already seen this policy, skip
+        retobj.add_link(link, sim_score, 0, True, False, False)
+    return output_count
+
+def finish_domain(retobj, rejects):
+    """
+    Record the domain's pre-filter rejections and update the progress
+    bar.  The domain statistics are computed from the returned results in
+    produce_summary(), not collected here.
+    In:     retobj - CrawlReturn obj of the domain
+            rejects - Counter of pre-filter rejections for the domain
+    Out:    retobj
+    """
+    retobj.reject_counts = dict(rejects)
+    if not retobj.access_success:
+        print("failed to access domain: ", retobj.domain)
+
+    with index.get_lock():  # Update progress bar
+        index.value += 1
+        print_progress_bar(index.value, len(domain_list), prefix = "Crawling Progress:", suffix = "Complete", length = 50)
+    return retobj
+
 def crawl(domain_zip):
 
     """
     @Rui
     Primary function for the process pool.
-    Crawl websites for links to privacy policies.  First check if
-    the website can be reached at all, then find list of policy links
+    Crawl websites for links to privacy policies.  First look for
+    policy links in the sitemaps; if there are none, check if the
+    website can be reached at all, then find list of policy links
     on first page.  Then loop through links to see if the links are 
     valid policies.  Keep statistics in every subprocess for summary
     at end.
@@ -201,105 +460,521 @@ def crawl(domain_zip):
     """
     domain = domain_zip[0]
     domain_policy = domain_zip[1]
-    
-    # complete the domain with prefix “https://www.” first 
-    # since “https://www.” covers most cases
-    half_full_url = domain if ("www." in domain) else "www." + domain
-    full_url = half_full_url if ("https" in half_full_url) else "https://" + half_full_url
-    domain_html, all_links = request(full_url)
+    rejects = Counter()     # why pages were dropped before verification
 
-    # request failed, try other prefixes to the domain
-    if strip_text(domain_html) == "" and domain_html =="" and all_links ==[]:
-        full_url = domain if ("http" in domain) else  "http://" + domain       # try "http://"   
-        domain_html, all_links = request(full_url)
-        
-        if strip_text(domain_html) == "" and domain_html =="" and all_links ==[]:
-            full_url = domain if ("https" in domain) else  "https://" + domain # try "https://" 
-            domain_html, all_links = request(full_url)
-            
-            # all prefixed fail, so the domain fail to access
-            if strip_text(domain_html) == "" and domain_html =="" and all_links ==[]:
-                failed_access_domain = CrawlReturn(domain, False, domain_policy)
-                with index.get_lock():  # Update progress bar
-                    print("failed to access domain: ", full_url)
-                    index.value += 1
-                    print_progress_bar(index.value, len(domain_list), prefix = "Crawling Progress:", suffix = "Complete", length = 50)
-                return failed_access_domain
-
-    # get links from domain landing page, return if none found
-    links = find_policy_links(full_url, domain_html, all_links)
+    full_url, links, domain_html, all_links = fetch_landing(domain, rejects)
+    if len(links) == 0:
+        # all prefixed fail, so the domain fail to access
+        if domain_html == "" and all_links == []:
+            return finish_domain(CrawlReturn(domain, False, domain_policy), rejects)
+
+        # get links from domain landing page, return if none found
+        links = find_policy_links(full_url, domain_html, all_links)
     
     # no link case 
     if len(links) == 0:
-        no_link_domain = CrawlReturn(domain, True, domain_policy)
-        no_link_domains.append(no_link_domain.domain)
-        with index.get_lock():  # Update progress bar
-            index.value += 1
-            print_progress_bar(index.value, len(domain_list), prefix = "Crawling Progress:", suffix = "Complete", length = 50)
-        return no_link_domain
+        return finish_domain(CrawlReturn(domain, True, domain_policy), rejects)
 
     # go down the link rabbit hole to download the html and verify that they are policies
     retobj = CrawlReturn(domain, True, domain_policy)
-    domain_successful_links = []
-    domain_failed_links = []
     depth_count = 0
     output_count = 0
     for link in links:
-        link_html, link_all_links = request(link)
-        link_contents = strip_text(link_html) 
+        validators = {}
+        link_html, link_all_links = request(link, max_content_bytes, rejects, validators, render_modes)
+        expand = depth_count < max_crawler_depth
+        link_contents, new_links, sim_score, reject_reason = score_page(full_url, link_html, link_all_links, expand)
+        if needs_render(link_html, link_contents, validators):
+            link_html, link_all_links = request(link, max_content_bytes, rejects, validators, render_modes, render=True)
+            link_contents, new_links, sim_score, reject_reason = score_page(full_url, link_html, link_all_links, expand)
+        if replay_store is not None:
+            replay_store.add_page(link, link_html, link_all_links)
+            replay_store.add_score(link, link_contents == "", sim_score)
  
         if link_contents == "":
-            domain_failed_links.append(link)
-            retobj.add_link(link, 0.0, "N/A", "N/A", False, False, False)
+            retobj.add_link(link, 0.0, 0, False, False, False)
             continue    # policy is empty, skip this whole thing
-        
-        # add links on this page to the list to be visited if they are new
-        if depth_count < max_crawler_depth:
+
+        if expand:
             depth_count += 1
-            new_links = find_policy_links(full_url, link_html, link_all_links)
             for l in new_links:
                 if l not in links:
                     links.append(l)
+        if reject_reason is not None:
+            rejects[reject_reason] += 1
+        output_count = record_link(retobj, link, link_html, link_contents, sim_score, validators, output_count)
+    
+    return finish_domain(retobj, rejects)
 
-        # get similarity score, check against the score threshold to see if policy
-        sim_score = verify(link_contents, ground_truth)
-        is_policy = sim_score >= cos_sim_threshold
-
-        # if this page is a policy, check duplicate then write out to file
-        if is_policy:
-            if is_duplicate_policy(link_contents, domain, policy_dict):
-                retobj.add_link(link, 0.0, "N/A", "N/A", True, True, True)
-                continue    # we've already seen this policy, skip
-            domain_successful_links.append(link)
-            output_count += 1
-            html_outfile = html_outfolder + domain[:-4] + "_" + str(output_count) + ".html"
-            with open(html_outfile, "a") as fp:
-                fp.write(link_html)
-            stripped_outfile = stripped_outfolder + domain[:-4] + "_" + str(output_count) + ".txt"
-            with open(stripped_outfile, "a") as fp:
-                fp.write(link_contents)
-            retobj.add_link(link, sim_score, html_outfile, stripped_outfile, True, True, False)
-        
-        # this isn't a policy, so just add it to the stats and continue
+def revalidate(domain_zip, record):
+    """
+    Incremental mode for a domain that had policies last run.  Revalidate
+    every accepted policy link with a conditional request (or by rendering
+    it again, if it was rendered last run) and compare the
+    stripped text against last run's fingerprint, read from the folders
+    last run wrote to.  If anything changed (or a link is gone), last
+    run's output for the domain is removed so it can be crawled again from
+    scratch; unless this run writes to other folders, in which case last
+    run's output is kept and unchanged policies are copied over.
+    In:     domain_zip - (domain, true policy link) as for crawl()
+            record - the domain's entry in the previous results.json
+    Out:    CrawlReturn obj reused from the record, None if it changed
+    """
+    domain = domain_zip[0]
+    retobj = from_record(domain, record)
+    policy_texts = []
+    for link in retobj.link_list:
+        if not link.valid or link.duplicate:
+            continue
+        status, link_html, validators = conditional_request(link.link, link.validators, max_content_bytes)
+        if status == 304 and os.path.exists(link.stripped_outfile):
+            with open(link.stripped_outfile, "r") as fp:
+                link_contents = fp.read()
+        elif status == 200:
+            link_contents = strip_text(link_html)
         else:
-            if is_duplicate_policy(link_contents, domain, policy_dict):
-                retobj.add_link(link, 0.0, "N/A", "N/A", True, False, True)
-                continue    # we've already seen this policy, skip
-            domain_failed_links.append(link)
-            retobj.add_link(link, sim_score, "N/A", "N/A", True, False, False)
-    
-    if sum(link.valid == True for link in retobj.link_list) == 0:
-        failed_link_domains.append(retobj.domain)
-    else:
-        successful_domains.append(retobj)
-        if retobj.policy_ground_truth == None:
-        
-    with index.get_lock():  # Update progress bar
-        index.value += 1
-        print_progress_bar(index.value, len(domain_list), prefix = "Crawling Progress:", suffix = "Complete", length = 50)
-    
+            link_contents = None
+        if link_contents is None or fingerprint_text(link_contents) != link.fingerprint:
+            # policy changed or vanished, throw away last run's output if it's in our folders
+            if retobj.outfolders in (None, (html_outfolder, stripped_outfolder)):
+                for old_link in retobj.link_list:
+                    for outfile in outfile_names(domain, old_link.output):
+                        if outfile != "N/A" and os.path.exists(outfile):
+                            os.remove(outfile)
+            return None
+        link.validators = validators
+        policy_texts.append(link_contents)
+
+    # nothing changed, carry the output over and register the policies and
+    # links as crawl() would have
+    for link in retobj.link_list:
+        for old_outfile, outfile in zip(outfile_names(domain, link.output, retobj.outfolders), outfile_names(domain, link.output)):
+            if old_outfile != outfile and os.path.exists(old_outfile):
+                shutil.copyfile(old_outfile, outfile)
+    retobj.outfolders = None
+    for link_contents in policy_texts:
+        is_duplicate_policy(link_contents, domain, policy_dict)
+    for link in retobj.link_list:
+        link_dict[link.link] = 0
+    retobj.change = "unchanged"
+    return retobj
+
+def has_policies(record):
+    """
+    Out:    whether a previous results.json record has any accepted policy
+    """
+    return record is not None and any(link["valid"] and not link["duplicate"] for link in record["links"])
+
+def incremental_crawl(domain_zip):
+    """
+    Entry point for the process pool in incremental mode.  Domains that
+    had policies in the previous run are revalidated, everything else
+    (new domains and domains that failed last time) is crawled in full.
+    In:     domain_zip - (domain, true policy link) as for crawl()
+    Out:    CrawlReturn obj with its change attribute set
+    """
+    record = previous_results.get(domain_zip[0])
+    if has_policies(record):
+        retobj = revalidate(domain_zip, record)
+        if retobj is not None:
+            return finish_domain(retobj, Counter())
+        retobj = crawl(domain_zip)
+        retobj.change = "changed"
+        return retobj
+    retobj = crawl(domain_zip)
+    retobj.change = "new" if record is None else "retried"
     return retobj
 
+class DomainState():
+    """
+    Progress of one domain through the staged pipeline.  A domain has at
+    most one page in flight at a time, so the stages never touch the same
+    DomainState concurrently and links are visited in crawl() order.
+    """
+    def __init__(self, position, domain_zip):
+        self.position = position            # index in the domain list
+        self.domain_zip = domain_zip
+        self.rejects = Counter()
+        self.change = None
+        self.full_url = None
+        self.links = []
+        self.next_link = 0
+        self.depth_count = 0
+        self.output_count = 0
+        self.retobj = None
+        self.render = False                 # fetch the next link with selenium
+        self.record = None                  # previous run's record, if it is to be revalidated
+        if previous_results is not None:
+            record = previous_results.get(domain_zip[0])
+            self.record = record if has_policies(record) else None
+            self.change = "new" if record is None else "retried"
+
+class StageCounter():
+    """
+    Thread-safe count of the tasks currently inside a pipeline stage.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+    def add(self, n):
+        with self.lock:
+            self.value += n
+
+def run_pipeline(domain_zips, fetch_workers, parse_workers, max_active_domains, write_queue_size, report_interval=30):
+    """
+    Crawl the domains as a pipeline of stages instead of one crawl() per
+    process.  A pool of fetch threads does all network I/O, a process pool
+    strips, scores and extracts links from the fetched pages, a writer
+    thread writes the policies out, and this thread moves every domain
+    from one stage to the next.  At most max_active_domains domains are
+    in the pipeline at once, which bounds every queue between the stages
+    and so memory.  Queue depths are printed every report_interval
+    seconds to help size the stages.
+    In:     domain_zips - list of (domain, true policy link) as for crawl()
+            fetch_workers - number of fetch threads
+            parse_workers - number of parse/verify processes
+            max_active_domains - max number of domains in flight
+            write_queue_size - max number of pending output file writes
+    Out:    list of CrawlReturn objects in domain_zips order
+    """
+    fetch_queue = queue.Queue()     # (DomainState, link or None for the landing page)
+    parsed_queue = queue.Queue()    # (DomainState, fetch result, parse result)
+    write_queue = queue.Queue(maxsize=write_queue_size)
+    parsing = StageCounter()
+    parse_pool = Pool(processes=parse_workers, initializer=start_process, initargs=[index])
+
+    def parse(state, fetched, function, args):
+        """
+        Hand a fetched page to the parse stage, results land in parsed_queue.
+        """
+        def done(parsed):
+            parsing.add(-1)
+            parsed_queue.put((state, fetched, parsed))
+        def failed(e):
+            print("PARSE PROBLEM: " + str(e))
+            done(None)
+        parsing.add(1)
+        parse_pool.apply_async(function, args, callback=done, error_callback=failed)
+
+    def fetcher():
+        while True:
+            task = fetch_queue.get()
+            if task is None:
+                return
+            state, link = task
+            try:
+                if link is None:
+                    if state.record is not None:
+                        reused = revalidate(state.domain_zip, state.record)
+                        if reused is not None:
+                            parsed_queue.put((state, reused, None))
+                            continue
+                        state.change = "changed"
+                    fetched = fetch_landing(state.domain_zip[0], state.rejects)
+                    full_url, links, domain_html, all_links = fetched
+                    if len(links) > 0 or (domain_html == "" and all_links == []):
+                        parsed_queue.put((state, fetched, None))     # nothing to parse
+                    else:
+                        parse(state, fetched, find_policy_links, (full_url, domain_html, all_links))
+                else:
+                    validators = {}
+                    render, state.render = state.render, False
+                    link_html, link_all_links = request(link, max_content_bytes, state.rejects, validators, render_modes, render)
+                    if replay_store is not None:
+                        replay_store.add_page(link, link_html, link_all_links)
+                    fetched = (link, link_html, validators)
+                    expand = state.depth_count < max_crawler_depth
+                    parse(state, fetched, score_page, (state.full_url, link_html, link_all_links, expand))
+            except Exception as e:
+                print(traceback.format_exc())
+                parsed_queue.put((state, None, None))
+
+    def writer():
+        while True:
+            task = write_queue.get()
+            if task is None:
+                return
+            write_outfile(*task)
+
+    def advance(state, fetched, parsed):
+        """
+        Apply a stage result to the domain.
+        Out:    next link to fetch, None once the domain is done
+        """
+        domain, domain_policy = state.domain_zip
+        if state.retobj is None:    # landing page stage
+            if isinstance(fetched, CrawlReturn):    # unchanged since the previous run
+                state.retobj = fetched
+                return None
+            if fetched is None:
+                state.retobj = CrawlReturn(domain, False, domain_policy)
+                return None
+            state.full_url, links, domain_html, all_links = fetched
+            if len(links) == 0:
+                if domain_html == "" and all_links == []:
+                    state.retobj = CrawlReturn(domain, False, domain_policy)
+                    return None
+                links = parsed or []
+            state.links = links
+            state.retobj = CrawlReturn(domain, True, domain_policy)
+            if len(links) == 0:
+                return None
+        else:   # policy link stage
+            link = state.links[state.next_link]
+            if fetched is not None and parsed is not None and needs_render(fetched[1], parsed[0], fetched[2]):
+                state.render = True     # send it back to be fetched with selenium
+                return link
+            state.next_link += 1
+            if fetched is None or parsed is None or parsed[0] == "":
+                state.retobj.add_link(link, 0.0, 0, False, False, False)
+                if replay_store is not None:
+                    replay_store.add_score(link, True, 0.0)
+            else:
+                link, link_html, validators = fetched
+                link_contents, new_links, sim_score, reject_reason = parsed
+                if replay_store is not None:
+                    replay_store.add_score(link, False, sim_score)
+                if state.depth_count < max_crawler_depth:
+                    state.depth_count += 1
+                    for l in new_links:
+                        if l not in state.links:
+                            state.links.append(l)
+                if reject_reason is not None:
+                    state.rejects[reject_reason] += 1
+                state.output_count = record_link(state.retobj, link, link_html, link_contents, sim_score, validators,
+                                                 state.output_count, write=lambda outfile, contents: write_queue.put((outfile, contents)))
+        if state.next_link < len(state.links):
+            return state.links[state.next_link]
+        return None
+
+    fetch_threads = [threading.Thread(target=fetcher, daemon=True) for i in range(fetch_workers)]
+    write_thread = threading.Thread(target=writer, daemon=True)
+    for thread in fetch_threads + [write_thread]:
+        thread.start()
+
+    results = [None] * len(domain_zips)
+    pending = iter(enumerate(domain_zips))
+    active = 0
+    exhausted = False
+    last_report = time.time()
+    while True:
+        # admit new domains while there is room, this is the backpressure
+        while not exhausted and active < max_active_domains:
+            try:
+                position, domain_zip = next(pending)
+            except StopIteration:
+                exhausted = True
+                break
+            state = DomainState(position, domain_zip)
+            fetch_queue.put((state, None))
+            active += 1
+        if active == 0:
+            break
+
+        if time.time() - last_report >= report_interval:
+            print("\nPipeline queues: " + ", ".join(name + " = " + str(depth) for name, depth in pipeline_depths(fetch_queue, parsing, parsed_queue, write_queue).items()))
+            last_report = time.time()
+        try:
+            state, fetched, parsed = parsed_queue.get(timeout=report_interval)
+        except queue.Empty:
+            continue
+        next_link = advance(state, fetched, parsed)
+        if next_link is not None:
+            fetch_queue.put((state, next_link))
+            continue
+        if state.change is not None and state.retobj.change is None:
+            state.retobj.change = state.change
+        results[state.position] = finish_domain(state.retobj, state.rejects)
+        active -= 1
+
+    for thread in fetch_threads:
+        fetch_queue.put(None)
+    write_queue.put(None)
+    for thread in fetch_threads + [write_thread]:
+        thread.join()
+    parse_pool.close()
+    parse_pool.join()
+    return results
+
+def pipeline_depths(fetch_queue, parsing, parsed_queue, write_queue):
+    """
+    Out:    dict of pipeline stage -> number of tasks waiting in or
+            running through it
+    """
+    return {"fetch": fetch_queue.qsize(),
+            "parse": parsing.value,
+            "advance": parsed_queue.qsize(),
+            "write": write_queue.qsize()}
+
+def produce_change_report(all_links):
+    """
+    Produce string output for the change report of an incremental crawl.
+    Gone domains either left the domain list or had their policies vanish
+    on this crawl.
+    In:     list of CrawlReturn objects from incremental_crawl()
+    Out:    string representation to be written out to file.
+    """
+    changes = {"new": [], "changed": [], "unchanged": [], "retried": [], "gone": []}
+    crawled = set()
+    for domain in all_links:
+        crawled.add(domain.domain)
+        valid = domain.num_valid() > 0
+        change = domain.change
+        if change is None:  # a distributed worker gave up on the domain
+            change = "new" if domain.domain not in previous_results else "retried"
+        if change == "changed" and not valid:
+            change = "gone"
+        changes[change].append(domain.domain)
+    for domain in previous_results:
+        if domain not in crawled:
+            changes["gone"].append(domain)
+
+    report_string = "Changes since previous crawl (" + previous_results_file + ")\n"
+    for change, domains in changes.items():
+        report_string += "   " + change + " = " + str(len(domains)) + "\n"
+    for change, domains in changes.items():
+        report_string += "\n" + change + ":\n"
+        for domain in domains:
+            report_string += domain + "\n"
+    return report_string
+
+def heartbeat(owner, task_ids, stop):
+    """
+    Keep pushing back the leases of a batch until stop is set, so a slow
+    but live worker doesn't lose a domain halfway through crawling it.
+    Leases already completed or failed are left alone by extend().
+    """
+    while not stop.wait(work_queue.lease_timeout / 3):
+        work_queue.extend(owner, task_ids)
+
+def remove_outfiles(domain):
+    """
+    Delete the policy output files written for a domain by an earlier,
+    failed attempt at it.
+    """
+    output = 1
+    while True:
+        outfiles = [outfile for outfile in outfile_names(domain, output) if os.path.exists(outfile)]
+        if outfiles == []:
+            return
+        for outfile in outfiles:
+            os.remove(outfile)
+        output += 1
+
+def work_loop(worker_num):
+    """
+    Worker side of a distributed crawl.  Lease batches of domains from the
+    shared work queue, crawl them, and push each result back.  A heartbeat
+    thread extends the batch's leases while it is crawled, so only a
+    worker that died or hung loses its batch to someone else.  Every
+    domain is crawled against its own view of the shared dedupe tables,
+    published only once its result is, so that a retried domain isn't
+    deduped against what its failed attempt saw.
+    In:     worker_num - index of this worker process on the node
+    Out:    number of domains crawled by this worker
+    """
+    global domain_list, policy_dict, link_dict
+    owner = socket.gethostname() + "-" + str(os.getpid())
+    shared_policy_dict, shared_link_dict = policy_dict, link_dict
+    crawled = 0
+    while True:
+        batch = work_queue.lease(owner, batch_size)
+        if batch == []:
+            if work_queue.loaded() and work_queue.unfinished() == 0:
+                return crawled
+            sleep(poll_interval)    # not loaded yet, or remaining domains are leased by other workers
+            continue
+        if len(domain_list) == 0:   # started before the coordinator loaded the queue
+            domain_list = work_queue.domains()
+
+        stop = threading.Event()
+        beat = threading.Thread(target=heartbeat, args=(owner, [task[0] for task in batch], stop), daemon=True)
+        beat.start()
+        try:
+            for task_id, domain, policy, attempt in batch:
+                policy_dict = shared_policy_dict.attempt()
+                link_dict = shared_link_dict.attempt()
+                try:
+                    if previous_results is None:
+                        if attempt > 1:
+                            remove_outfiles(domain)
+                        result = crawl((domain, policy))
+                    else:
+                        result = incremental_crawl((domain, policy))
+                except Exception as e:
+                    print(traceback.format_exc())
+                    work_queue.fail(owner, task_id)
+                    continue
+                if work_queue.complete(owner, task_id, result, [policy_dict, link_dict]):
+                    crawled += 1
+        finally:
+            stop.set()
+            beat.join()
+            policy_dict, link_dict = shared_policy_dict, shared_link_dict
+
+def collect_queue_results(work_queue):
+    """
+    Coordinator side of a distributed crawl.  Rebuild the results list from
+    what the workers pushed to the queue.
+    In:     work_queue - WorkQueue every domain has finished on
+    Out:    list of CrawlReturn objects in domain list order
+    """
+    all_links = []
+    for domain, policy, result in work_queue.results():
+        if result is None:  # gave up on this domain after max_attempts leases
+            result = CrawlReturn(domain, False, policy)
+        all_links.append(result)
+    return all_links
+
+def build_result_table(all_links):
+    """
+    Gather the columns of every CrawlReturn into flat NumPy arrays, so the
+    summary statistics are computed over all links at once.
+    In:     list of CrawlReturn objects
+    Out:    dict of column name -> array; per-domain columns access, n_links,
+            n_valid and sim_avg, per-link columns domain_index, sim_score
+            and flags
+    """
+    import numpy as np    # only needed once, at the end of the run
+    n_links = np.array([len(domain.links) for domain in all_links], dtype=np.int64)
+    table = {"access": np.array([domain.access_success for domain in all_links], dtype=bool),
+             "n_links": n_links,
+             "domain_index": np.repeat(np.arange(len(all_links)), n_links),
+             "sim_score": np.concatenate([np.frombuffer(domain.sim_scores, dtype=np.float64) for domain in all_links] or [np.zeros(0)]),
+             "flags": np.concatenate([np.frombuffer(domain.flags, dtype=np.uint8) for domain in all_links] or [np.zeros(0, dtype=np.uint8)])}
+    valid = (table["flags"] & VALID) != 0
+    table["n_valid"] = np.bincount(table["domain_index"], weights=valid, minlength=len(all_links))
+    sim_sum = np.bincount(table["domain_index"], weights=table["sim_score"], minlength=len(all_links))
+    table["sim_avg"] = np.divide(sim_sum, n_links, out=np.zeros(len(all_links)), where=n_links > 0)
+    return table
+
+def find_policy_link(all_links, table):
+    """
+    Pick each domain's policy link: its highest scoring (rounded to two
+    places) accessed, non-duplicate link on the domain itself, the first
+    one on ties.
+    In:     list of CrawlReturn objects and their build_result_table()
+    Out:    (policy link, its rounded score) per domain, ("", 0) if none
+    """
+    import numpy as np
+    rounded = np.round(table["sim_score"], 2)
+    flags = table["flags"]
+    candidate = ((flags & ACCESS) != 0) & ((flags & DUPLICATE) == 0) & (rounded > 0)
+    candidate &= np.fromiter((domain.domain in link for domain in all_links for link in domain.links),
+                             dtype=bool, count=len(flags))
+    offsets = np.concatenate(([0], np.cumsum(table["n_links"])))
+    policy_links = [("", 0)] * len(all_links)
+    index = np.flatnonzero(candidate)
+    if len(index) > 0:
+        # sort by domain, then score descending, then position; the first of each domain wins
+        order = index[np.lexsort((index, -rounded[index], table["domain_index"][index]))]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = table["domain_index"][order][1:] != table["domain_index"][order][:-1]
+        for i in order[first]:
+            d = table["domain_index"][i]
+            policy_links[d] = (all_links[d].links[i - offsets[d]], float(rounded[i]))
+    return policy_links
+
 def produce_summary(all_links):
     """
     @Rui
@@ -309,52 +984,52 @@ def produce_summary(all_links):
     In:     list CrawlerReturn objects containing links and statistics
     Out:    string representation to be written out to file.
     """
+    import numpy as np
     timestamp = "_{0:%Y%m%d-%H%M%S}".format(datetime.datetime.now())
     summary_string = "Summary of Crawler Output (" + timestamp + ")\n"
-    
-    for domain in all_links:
-        max_sim_score = 0
-        policy_link = ""
-        if not domain.access_success:
-            failed_access_domains.append(domain.domain)
-            continue;
+    table = build_result_table(all_links)
+    policy_links = find_policy_link(all_links, table)
+    find_true_policy_domains = []
+
+    for d, domain in enumerate(all_links):
         if not domain.access_success:
-            summary_string += (domain.domain + " -- NO_ACCESS\n\n")
-        if domain.access_success and len(domain.link_list) == 0:
+            continue
+        policy_link, max_sim_score = policy_links[d]
+        if len(domain.links) == 0:
             summary_string += (domain.domain + " -- NO_LINKS\n\n")
         else:
-            sim_avg = str(round(domain.sim_avg, 2))
+            sim_avg = str(round(table["sim_avg"][d], 2))
             summary_string += (domain.domain + " (avg sim = " + sim_avg + ")" + "\n")
             for link in domain.link_list:
-                max_sim_score = 0
-                policy_link = ""
-                sim_score = str(round(link.sim_score, 2))
-                if link.access_success == False:
+                if not link.access_success:
                     summary_string += ("=> (NO_ACCESS) " + link.link + " -> ")
-                elif link.duplicate == True:
+                elif link.duplicate:
                     summary_string += ("=> (DUPLICATE) " + link.link + " -> ")
                 else:
-                    summary_string += ("=> (" + sim_score + ") " + link.link + " -> ")
-                    if round(link.sim_score, 2) > max_sim_score and domain.domain in link.link:
-                        max_sim_score = round(link.sim_score, 2)
-                        policy_link = link.link
+                    summary_string += ("=> (" + str(round(link.sim_score, 2)) + ") " + link.link + " -> ")
                 summary_string += (link.html_outfile + " & " + link.stripped_outfile + "\n")
             summary_string += ("=> (" + "privacy policy" + ") " + policy_link)
             summary_string += "\n"
         print(domain.domain, policy_link, max_sim_score)
         if domain.policy_ground_truth != None:
-            if policy_link == domain.policy_ground_truth:
-                domain.find_true_policy = True
-                find_true_policy_domains.append(domain.domain)
-            elif is_same_webpage(policy_link, domain.policy_ground_truth):
+            if policy_link == domain.policy_ground_truth or is_same_webpage(policy_link, domain.policy_ground_truth):
                 domain.find_true_policy = True
                 find_true_policy_domains.append(domain.domain)
 
-    summary_string += "   # of Successful Domains = " + str(len(successful_domains)) + " (" + str(round(len(successful_domains)/len(domain_list)*100, 2)) + "%).\n"
-    summary_string += "   Could not access " + str(len(failed_access_domains)) + " (" + str(round(len(failed_access_domains)/len(domain_list)*100, 2)) + "%) domains.\n"
-    summary_string += "   No links found for " + str(len(no_link_domains)) + " (" + str(round(len(no_link_domains)/len(domain_list)*100, 2)) + "%) domains.\n"
-    summary_string += "   No valid links found for " + str(len(failed_link_domains)) + " (" + str(round(len(failed_link_domains)/len(domain_list)*100, 2)) + "%) domains.\n"
+    access = table["access"]
+    counts = {"successful": int(np.sum(access & (table["n_valid"] > 0))),
+              "failed_access": int(np.sum(~access)),
+              "no_link": int(np.sum(access & (table["n_links"] == 0))),
+              "failed_link": int(np.sum(access & (table["n_links"] > 0) & (table["n_valid"] == 0)))}
+    summary_string += "   # of Successful Domains = " + str(counts["successful"]) + " (" + str(round(counts["successful"]/len(domain_list)*100, 2)) + "%).\n"
+    summary_string += "   Could not access " + str(counts["failed_access"]) + " (" + str(round(counts["failed_access"]/len(domain_list)*100, 2)) + "%) domains.\n"
+    summary_string += "   No links found for " + str(counts["no_link"]) + " (" + str(round(counts["no_link"]/len(domain_list)*100, 2)) + "%) domains.\n"
+    summary_string += "   No valid links found for " + str(counts["failed_link"]) + " (" + str(round(counts["failed_link"]/len(domain_list)*100, 2)) + "%) domains.\n"
     summary_string += "   # of true policy domains = " + str(len(find_true_policy_domains)) + ".\n"
+    reject_counts = Counter()
+    for domain in all_links:
+        reject_counts.update(domain.reject_counts)
+    summary_string += "   Pre-filter rejections: " + (", ".join(reason + " = " + str(count) for reason, count in reject_counts.most_common()) or "none") + ".\n"
     summary_string += "\n"    
     
     return summary_string
@@ -376,6 +1051,77 @@ if __name__ == '__main__':
                             default=-1,
                             required=False,
                             help="number of domains to crawl.  If blank, set to entire input list.")
+    argparse.add_argument(  "--role",
+                            choices=["local", "coordinator", "worker"],
+                            default="local",
+                            required=False,
+                            help="local crawls on this machine only.  coordinator loads the domain list into --queue and writes the summary once workers finish it; worker crawls domains leased from --queue.")
+    argparse.add_argument(  "--queue",
+                            required=False,
+                            help="SQLite file holding the shared work queue for coordinator and worker roles.")
+    argparse.add_argument(  "--workers",
+                            type=int,
+                            default=-1,
+                            required=False,
+                            help="number of worker processes on this node.  If blank, set to cpu_count() - 1 (0 for a coordinator).")
+    argparse.add_argument(  "--batch_size",
+                            type=int,
+                            default=10,
+                            required=False,
+                            help="number of domains a worker leases at a time.")
+    argparse.add_argument(  "--lease_timeout",
+                            type=int,
+                            default=600,
+                            required=False,
+                            help="seconds before an unfinished lease is handed to another worker.")
+    argparse.add_argument(  "--shared_fs",
+                            action="store_true",
+                            help="the queue database is on a network filesystem shared by several nodes.  Uses SQLite's rollback journal instead of WAL.")
+    argparse.add_argument(  "--pipeline",
+                            action="store_true",
+                            help="local role only: crawl with separate fetch, parse/verify and write stages instead of one crawl() per process.  --workers sets the number of parse/verify processes.")
+    argparse.add_argument(  "--fetch_workers",
+                            type=int,
+                            default=32,
+                            required=False,
+                            help="number of fetch threads in the pipeline.")
+    argparse.add_argument(  "--max_active_domains",
+                            type=int,
+                            default=64,
+                            required=False,
+                            help="max number of domains in the pipeline at once, bounds the queues between stages.")
+    argparse.add_argument(  "--write_queue_size",
+                            type=int,
+                            default=256,
+                            required=False,
+                            help="max number of output files waiting for the pipeline's writer.")
+    argparse.add_argument(  "--max_content_bytes",
+                            type=int,
+                            default=MAX_CONTENT_BYTES,
+                            required=False,
+                            help="largest page body to download; bigger pages are dropped without being parsed.")
+    argparse.add_argument(  "--min_policy_length",
+                            type=int,
+                            default=MIN_POLICY_LENGTH,
+                            required=False,
+                            help="pages with less stripped text than this many characters are not scored.")
+    argparse.add_argument(  "--min_policy_term_density",
+                            type=float,
+                            default=MIN_POLICY_TERM_DENSITY,
+                            required=False,
+                            help="pages where fewer than this fraction of words are common policy terms are not scored.")
+    argparse.add_argument(  "--skip_sitemaps",
+                            action="store_true",
+                            help="always find policy links on the landing page instead of looking in robots.txt and sitemaps first.")
+    argparse.add_argument(  "--render_modes_file",
+                            required=False,
+                            help="json file remembering which hosts need selenium or are blocked, read at the start and (local role) updated at the end of the run.")
+    argparse.add_argument(  "--record",
+                            required=False,
+                            help="SQLite file to record every fetched page, its links and its similarity score in, for offline tuning with replay.py.")
+    argparse.add_argument(  "--previous_results",
+                            required=False,
+                            help="results.json of an earlier crawl.  Only domains whose policies changed, or that are new or failed last time, are crawled again.")
     argparse.add_argument(  "domain_list_file",
                             help="json file containing list of top N sites to visit.",                       
                             action=VerifyJsonExtension)
@@ -394,6 +1140,10 @@ if __name__ == '__main__':
     argparse.add_argument(  "stripped_outfolder",
                             help="directory to dump stripped text output of crawler.")
     args = argparse.parse_args()
+    if args.role != "local" and args.queue is None:
+        argparse.error("--queue is required for the " + args.role + " role")
+    if args.role != "local" and args.pipeline:
+        argparse.error("--pipeline only works with the local role")
     domain_list_file = args.domain_list_file
     ground_truth_html_dir = args.ground_truth_html_dir
     dictionary = args.dictionary
@@ -401,9 +1151,33 @@ if __name__ == '__main__':
     max_crawler_depth = args.max_crawler_depth
     html_outfolder = args.html_outfolder
     stripped_outfolder = args.stripped_outfolder
-    mkdir_clean(html_outfolder)
-    mkdir_clean(stripped_outfolder)
+    batch_size = args.batch_size
+    max_content_bytes = args.max_content_bytes
+    skip_sitemaps = args.skip_sitemaps
+    replay_store = ReplayStore(args.record) if args.record is not None else None
+    min_policy_length = args.min_policy_length
+    min_policy_term_density = args.min_policy_term_density
+    poll_interval = 5
+    previous_results_file = args.previous_results
+    previous_results = None
+    if previous_results_file is not None:
+        with open(previous_results_file, "r") as fp:
+            previous_results = json.load(fp)
+    work_queue = None
+    if args.role != "local":
+        work_queue = WorkQueue(args.queue, lease_timeout=args.lease_timeout, shared_fs=args.shared_fs)
+    if args.role == "worker" or previous_results is not None or (work_queue is not None and work_queue.loaded()):
+        # other workers may share these folders, incremental runs reuse the
+        # previous output and a restarted coordinator resumes its queue, so
+        # never wipe them
+        os.makedirs(html_outfolder, exist_ok=True)
+        os.makedirs(stripped_outfolder, exist_ok=True)
+    else:
+        mkdir_clean(html_outfolder)
+        mkdir_clean(stripped_outfolder)
     summary_outfile = args.html_outfolder + "../summary.txt"
+    results_outfile = args.html_outfolder + "../results.json"
+    changes_outfile = args.html_outfolder + "../changes.txt"
     sys.setrecursionlimit(10**6)
 
     # get domain list, domain policy url and verification ground truth
@@ -415,32 +1189,66 @@ if __name__ == '__main__':
         domain_list = domain_list[:args.num_domains]
         
     ground_truth = get_ground_truth(ground_truth_html_dir)
+    gc.freeze()     # keep the collector from touching (and so copying) the parent's objects in forked workers
 
     # set up shared resources for subprocesses
     index = Value("i",0)        # shared val, index of current crawled domain
     shared_manager = Manager()    # manages lists shared among child processes
-    successful_domains = shared_manager.list()       # at least one link in each domain is a valid policy
-    no_link_domains = shared_manager.list()          # domains with no links
-    failed_link_domains = shared_manager.list()      # domains with no valid links
-    failed_access_domains = shared_manager.list()    # domains where the initial access failed
-    find_true_policy_domains = shared_manager.list() # domains that find the correct link to privacy policy
     policy_dict = shared_manager.dict()              # hashmap of all texts to quickly detect duplicates
     link_dict = shared_manager.dict()                # hashmap of all links to detect duplicates without visiting them
+    render_modes = shared_manager.dict()             # host -> render mode so JS-only hosts skip plain requests
 
-    pool_size = cpu_count() - 1   
-    pool = Pool(
-        processes=pool_size,
-        initializer=start_process,
-        initargs=[index]
-    )
-    
-    driver=myfox().creatfirefox() # Instatiate a selenium Firefox webdriver 
-    
-    all_links = pool.map(crawl, list(zip(domain_list, domain_policy)))    # map keeps domain_list order
+    if args.role != "local":
+        # dedupe state lives in the queue so that every node shares it
+        if args.role == "coordinator":
+            work_queue.load(zip(domain_list, domain_policy))
+        domain_list = work_queue.domains()
+        policy_dict = work_queue.fingerprint_dict("policy")
+        link_dict = work_queue.fingerprint_dict("link")
+        render_modes = work_queue.fingerprint_dict("render")
+    render_modes = RenderModes(render_modes)    # counted per process, modes published to the shared dict
+    if args.render_modes_file is not None:
+        load_render_modes(args.render_modes_file, render_modes)
+
+    if args.workers != -1:
+        pool_size = args.workers
+    else:
+        pool_size = 0 if args.role == "coordinator" else cpu_count() - 1
+
+    if args.pipeline:
+        driver=myfox().creatfirefox() # Instatiate a selenium Firefox webdriver 
+        all_links = run_pipeline(list(zip(domain_list, domain_policy)), args.fetch_workers, max(pool_size, 1),
+                                 args.max_active_domains, args.write_queue_size)
+        driver.quit()
+
+    elif pool_size > 0:
+        pool = Pool(
+            processes=pool_size,
+            initializer=start_process,
+            initargs=[index]
+        )
+        driver=myfox().creatfirefox() # Instatiate a selenium Firefox webdriver 
+
+        if args.role == "local":
+            crawl_function = crawl if previous_results is None else incremental_crawl
+            all_links = pool.map(crawl_function, list(zip(domain_list, domain_policy)))    # map keeps domain_list order
+        else:
+            pool.map(work_loop, range(pool_size))
+
+        pool.close()  # no more tasks
+        pool.join()   # merge all child processes   
+        driver.quit() 
+
+    if args.role == "worker":
+        print("Queue drained: " + str(work_queue.counts()))
+        sys.exit(0)
 
-    pool.close()  # no more tasks
-    pool.join()   # merge all child processes   
-    driver.quit() 
+    if args.role == "coordinator":
+        while work_queue.unfinished() > 0:  # wait for the remote workers
+            work_queue.reclaim()
+            print("Waiting on workers: " + str(work_queue.counts()))
+            sleep(poll_interval)
+        all_links = collect_queue_results(work_queue)
     
     # produce summary output files
     print("Generating summary information...")
@@ -448,7 +1256,14 @@ if __name__ == '__main__':
     # add some evaluation and summary on the privacy policy result 
     with open(summary_outfile, "w") as fp:
         fp.write(produce_summary(all_links))
+
+    # keep the results around for the next incremental run
+    with open(results_outfile, "w") as fp:
+        json.dump({domain.domain: to_record(domain) for domain in all_links}, fp)
+    if args.render_modes_file is not None and args.role == "local":
+        save_render_modes(args.render_modes_file, render_modes)
+    if previous_results is not None:
+        with open(changes_outfile, "w") as fp:
+            fp.write(produce_change_report(all_links))
         
     print("Done")
-
-    
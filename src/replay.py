@@ -0,0 +1,189 @@
+"""
+Privacy Policy Project
+Replay
+Re-runs policy discovery and verification over a crawl recorded with
+crawler.py --record, without any network access, to tune
+cos_sim_threshold, max_crawler_depth and the find_keywords() lists.
+Every keyword set and depth is walked once over the recorded pages; all
+thresholds are then evaluated together on the precomputed similarity
+scores.  Outputs precision/recall of the chosen policy link against the
+PrivacyPolicy_English_footer ground truth links for every setting.
+"""
+
+import argparse, json, sys
+import numpy as np
+import crawler
+from utils.replay_store import ReplayStore
+from utils.sitemap import sitemap_patterns, sitemap_rank
+from utils.utils import VerifyJsonExtension
+
+def normalize_url(url):
+    """
+    Reduce a url to the part that identifies the page, so links that only
+    differ in scheme, "www." or a trailing slash compare equal.  Stands in
+    for is_same_webpage(), which would need the network.
+    In:     string representation of a URL link
+    Out:    normalized string, "" for a missing link
+    """
+    if not url:
+        return ""
+    url = crawler.clean_link(url.strip().lower())
+    url = url.split("://", 1)[-1]
+    if url.startswith("www."):
+        url = url[4:]
+    return url.rstrip("/")
+
+def replay_domain(domain, keywords, max_depth):
+    """
+    Walk one domain's recorded pages the way crawl() walks the live site.
+    Links that were never fetched while recording are treated as failed.
+    Sitemap links are only kept, and ranked, as discover_sitemap_links()
+    would for the keywords, since only the sitemap urls matching the
+    recording's keywords were stored; when none are left, the recorded
+    landing page is scanned instead.
+    In:     domain - domain from the domain list
+            keywords - keyword list, find_keywords() of the domain if None
+            max_depth - max_crawler_depth to replay with
+    Out:    list of candidate links visited, [] if the domain was unreachable
+    """
+    full_url, sitemap_links = replay_store.domain(domain)
+    if full_url is None:
+        return []
+    if keywords is not None:
+        patterns = sitemap_patterns(keywords)
+        sitemap_links = [link for link in sitemap_links if sitemap_rank(link, patterns) is not None]
+        sitemap_links.sort(key=lambda link: sitemap_rank(link, patterns))
+    links = list(sitemap_links)
+    if len(links) == 0:
+        landing = replay_store.page(full_url)
+        if landing is None:
+            return []
+        links = crawler.find_policy_links(full_url, landing[0], landing[1], keywords)
+
+    depth_count = 0
+    for link in links:
+        empty, sim_score = scores.get(link, (True, 0.0))
+        page = replay_store.page(link)
+        if empty or page is None:
+            continue
+        if depth_count < max_depth:
+            depth_count += 1
+            for l in crawler.find_policy_links(full_url, page[0], page[1], keywords):
+                if l not in links:
+                    links.append(l)
+    return links
+
+def sweep(domain_zips, keyword_sets, depths, thresholds):
+    """
+    Evaluate every (keyword set, depth, threshold) combination.  Each
+    domain's predicted policy is its highest scoring candidate on the
+    domain, as in produce_summary(); it counts as predicted at a threshold
+    when its score reaches it, so for one discovery setting all thresholds
+    come out of one comparison of the top scores against the threshold
+    vector.
+    In:     domain_zips - list of (domain, ground truth policy link)
+            keyword_sets - dict of name -> keyword list (None for find_keywords())
+            depths - list of max_crawler_depth values
+            thresholds - list of cos_sim_threshold values
+    Out:    list of result dicts, one per combination
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    truth = [normalize_url(policy) for domain, policy in domain_zips]
+    has_truth = np.array([t != "" for t in truth])
+    results = []
+    for name, keywords in keyword_sets.items():
+        for depth in depths:
+            crawler.link_dict = {}  # find_policy_links() dedupes links across domains in crawl order
+            top_score = np.zeros(len(domain_zips))
+            top_is_true = np.zeros(len(domain_zips), dtype=bool)
+            for i, (domain, policy) in enumerate(domain_zips):
+                best_score = -1.0
+                best_link = None
+                for link in replay_domain(domain, keywords, depth):
+                    empty, sim_score = scores.get(link, (True, 0.0))
+                    if not empty and domain in link and sim_score > best_score:
+                        best_score = sim_score
+                        best_link = link
+                if best_link is not None:
+                    top_score[i] = best_score
+                    top_is_true[i] = truth[i] != "" and normalize_url(best_link) == truth[i]
+
+            predicted = top_score[None, :] >= thresholds[:, None]   # thresholds x domains
+            predicted &= top_score[None, :] > 0
+            n_predicted = predicted.sum(axis=1)
+            true_positives = (predicted & top_is_true[None, :]).sum(axis=1)
+            precision = np.divide(true_positives, n_predicted, out=np.zeros(len(thresholds)), where=n_predicted > 0)
+            recall = true_positives / max(has_truth.sum(), 1)
+            for j, threshold in enumerate(thresholds):
+                results.append({"keywords": name, "depth": depth, "threshold": float(threshold),
+                                "predicted": int(n_predicted[j]), "true_positives": int(true_positives[j]),
+                                "precision": float(precision[j]), "recall": float(recall[j])})
+    return results
+
+def produce_report(results):
+    """
+    Out:    string table of the sweep results, best F1 first
+    """
+    def f1(result):
+        total = result["precision"] + result["recall"]
+        return 0.0 if total == 0 else 2 * result["precision"] * result["recall"] / total
+    report_string = "keywords\tdepth\tthreshold\tpredicted\ttrue_positives\tprecision\trecall\tf1\n"
+    for result in sorted(results, key=f1, reverse=True):
+        report_string += "\t".join([result["keywords"], str(result["depth"]), str(round(result["threshold"], 3)),
+                                    str(result["predicted"]), str(result["true_positives"]),
+                                    str(round(result["precision"], 3)), str(round(result["recall"], 3)),
+                                    str(round(f1(result), 3))]) + "\n"
+    return report_string
+
+if __name__ == '__main__':
+    argparse = argparse.ArgumentParser(description="Replays a recorded crawl offline to tune the crawler's thresholds and keywords.")
+    argparse.add_argument(  "replay_db",
+                            help="SQLite file written by crawler.py --record.")
+    argparse.add_argument(  "domain_list_file",
+                            help="json file containing the crawled sites and their true policy links.",
+                            action=VerifyJsonExtension)
+    argparse.add_argument(  "-n", "--num_domains",
+                            type=int,
+                            default=-1,
+                            required=False,
+                            help="number of domains to replay.  If blank, set to entire input list.")
+    argparse.add_argument(  "--thresholds",
+                            type=float,
+                            nargs="+",
+                            default=[round(0.3 + 0.05 * i, 2) for i in range(13)],
+                            help="cos_sim_threshold values to evaluate.")
+    argparse.add_argument(  "--depths",
+                            type=int,
+                            nargs="+",
+                            default=[1, 2, 3],
+                            help="max_crawler_depth values to evaluate.")
+    argparse.add_argument(  "--keyword_sets",
+                            required=False,
+                            help="json file of {name: [keywords]} to evaluate besides the find_keywords() lists.")
+    argparse.add_argument(  "--outfile",
+                            required=False,
+                            help="file to write the report to instead of stdout.")
+    args = argparse.parse_args()
+
+    with open(args.domain_list_file, "r") as fp:
+        domain_file = json.load(fp)
+        domain_policy = list(domain_file['PrivacyPolicy_English_footer'].values())
+        domain_list = list(domain_file['SiteName'].values())
+    if args.num_domains != -1:
+        domain_list = domain_list[:args.num_domains]
+
+    keyword_sets = {"find_keywords": None}
+    if args.keyword_sets is not None:
+        with open(args.keyword_sets, "r") as fp:
+            keyword_sets.update(json.load(fp))
+
+    replay_store = ReplayStore(args.replay_db)
+    scores = replay_store.scores()     # url -> (empty, sim_score), loaded once
+    results = sweep(list(zip(domain_list, domain_policy)), keyword_sets, args.depths, args.thresholds)
+
+    report_string = produce_report(results)
+    if args.outfile is None:
+        sys.stdout.write(report_string)
+    else:
+        with open(args.outfile, "w") as fp:
+            fp.write(report_string)
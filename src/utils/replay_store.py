@@ -0,0 +1,103 @@
+"""
+Privacy Policy Project
+replay_store.py
+Local record of a crawl, so that discovery and verification can be
+re-run offline.  A recording crawl stores every fetched page (compressed)
+with the links selenium found on it, how each domain was reached, and the
+similarity score of every candidate link.  replay.py reads it back to
+sweep thresholds and keyword lists without touching the network.
+"""
+
+import json, os, sqlite3, threading, zlib
+
+class ReplayStore():
+    """
+    SQLite file holding a recorded crawl.  Connections are opened per
+    process and per thread, so the store can be shared by the crawler's
+    pool processes and the pipeline's fetch threads alike.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._create_tables()
+
+    def _connect(self):
+        """
+        Return this thread's connection, reopening it after a fork.
+        """
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+            self._local.conn.execute("PRAGMA journal_mode=WAL")
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def _create_tables(self):
+        conn = self._connect()
+        conn.execute("""CREATE TABLE IF NOT EXISTS domains (
+                            domain TEXT PRIMARY KEY,
+                            full_url TEXT,
+                            sitemap_links TEXT)""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS pages (
+                            url TEXT PRIMARY KEY,
+                            html BLOB,
+                            all_links TEXT)""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS scores (
+                            url TEXT PRIMARY KEY,
+                            empty INTEGER,
+                            sim_score REAL)""")
+
+    def add_domain(self, domain, full_url, sitemap_links):
+        """
+        In:     domain - domain from the domain list
+                full_url - url the domain was reached at, None if it wasn't
+                sitemap_links - policy links found in the sitemaps
+        """
+        conn = self._connect()
+        conn.execute("INSERT OR REPLACE INTO domains VALUES (?, ?, ?)",
+                     (domain, full_url, json.dumps(sitemap_links)))
+
+    def add_page(self, url, html, all_links):
+        """
+        In:     url, html, all_links - a page as returned by request()
+        """
+        conn = self._connect()
+        conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)",
+                     (url, zlib.compress(html.encode("utf-8")), json.dumps(all_links)))
+
+    def add_score(self, url, empty, sim_score):
+        """
+        In:     url - candidate policy link
+                empty - whether the page stripped to nothing
+                sim_score - similarity score of the page, 0.0 if not scored
+        """
+        conn = self._connect()
+        conn.execute("INSERT OR REPLACE INTO scores VALUES (?, ?, ?)", (url, int(empty), sim_score))
+
+    def domain(self, domain):
+        """
+        Out:    (full_url, sitemap_links), (None, []) if never recorded or
+                unreachable
+        """
+        conn = self._connect()
+        row = conn.execute("SELECT full_url, sitemap_links FROM domains WHERE domain = ?", (domain,)).fetchone()
+        if row is None:
+            return None, []
+        return row[0], json.loads(row[1])
+
+    def page(self, url):
+        """
+        Out:    (html, all_links) as request() returned them, None if the
+                page was never fetched
+        """
+        conn = self._connect()
+        row = conn.execute("SELECT html, all_links FROM pages WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return zlib.decompress(row[0]).decode("utf-8"), json.loads(row[1])
+
+    def scores(self):
+        """
+        Out:    dict of url -> (empty, sim_score) for every recorded candidate
+        """
+        conn = self._connect()
+        return {url: (bool(empty), sim_score) for url, empty, sim_score in conn.execute("SELECT url, empty, sim_score FROM scores")}
@@ -0,0 +1,156 @@
+"""
+Privacy Policy Project
+sitemap.py
+Finds candidate policy links in a site's robots.txt and sitemaps, so that
+most domains never need their landing page fetched or rendered.  Every
+download is streamed and capped, gzipped sitemaps are decompressed on the
+fly, and sitemap XML is parsed incrementally so a huge sitemap never sits
+in memory as a whole.
+"""
+
+import requests, zlib
+from xml.etree import ElementTree
+from utils.utils import CHUNK_SIZE, REQUEST_HEADERS, read_body
+
+MAX_ROBOTS_BYTES = 512 * 1024
+MAX_SITEMAP_BYTES = 10 * 1024 * 1024   # uncompressed, the limit of the sitemap protocol
+MAX_SITEMAPS = 10       # sitemap files fetched per domain, index files included
+MAX_URLS = 50000        # sitemap urls scanned per domain
+MAX_LINKS = 20          # candidate policy links returned per domain
+GENERIC_KEYWORDS = frozenset(["help"])  # find_keywords() words too broad to pick pages out of a whole sitemap
+
+def find_sitemaps(full_url, max_bytes=MAX_ROBOTS_BYTES):
+    """
+    Read the Sitemap: lines of a site's robots.txt.
+    In:     full_url - landing page url, e.g. https://www.domain.com
+            max_bytes - robots.txt files bigger than this are ignored
+    Out:    list of sitemap urls, [] if robots.txt lists none, None if
+            the site could not be reached at all
+    """
+    try:
+        with requests.get(full_url + "/robots.txt", headers=REQUEST_HEADERS, timeout=(3,6), stream=True) as response:
+            if response.status_code != 200:
+                return []
+            body = read_body(response, max_bytes)
+    except Exception as e:
+        print("ROBOTS PROBLEM: " + str(e))
+        return None
+    if body is None:
+        return []
+
+    sitemaps = []
+    for line in body.decode("utf-8", errors="replace").splitlines():
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "sitemap" and value.strip():
+            sitemaps.append(value.strip())
+    return sitemaps
+
+def iter_sitemap(sitemap_url, max_bytes=MAX_SITEMAP_BYTES):
+    """
+    Stream a sitemap or sitemap index and yield its entries as they are
+    parsed.  Gzipped files are recognized by their magic bytes, since
+    servers label them inconsistently.  Stops quietly at max_bytes of
+    (uncompressed) xml or at the first parse error.
+    In:     sitemap_url - url of the sitemap
+            max_bytes - cap on the uncompressed size read
+    Out:    yields ("sitemap", url) for index entries, ("url", url) for pages
+    """
+    parser = ElementTree.XMLPullParser(events=("end",))
+    decompressor = None
+    size = 0
+    try:
+        with requests.get(sitemap_url, headers=REQUEST_HEADERS, timeout=(3,6), stream=True) as response:
+            if response.status_code != 200:
+                return
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if decompressor is None:
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if chunk[:2] == b"\x1f\x8b" else False
+                if decompressor:
+                    chunk = decompressor.decompress(chunk, max_bytes - size + 1)
+                size += len(chunk)
+                if size > max_bytes:
+                    return
+                parser.feed(chunk)
+                for event, elem in parser.read_events():
+                    tag = elem.tag.rsplit("}", 1)[-1]   # drop the sitemap namespace
+                    if tag in ("sitemap", "url"):
+                        for child in elem:
+                            if child.tag.rsplit("}", 1)[-1] == "loc" and child.text:
+                                yield ("sitemap" if tag == "sitemap" else "url"), child.text.strip()
+                        elem.clear()    # parsed entries are not kept around
+    except ElementTree.ParseError:
+        return  # not xml, e.g. an html error page served with a 200
+    except Exception as e:
+        print("SITEMAP PROBLEM: " + str(e))
+
+def keyword_patterns(keywords):
+    """
+    In:     list of keywords from find_keywords()
+    Out:    set of the keywords as they may appear in a url, with spaces
+            also written as "-", "_" or nothing
+    """
+    patterns = set()
+    for kw in keywords:
+        for sep in (" ", "-", "_", ""):
+            patterns.add(kw.lower().replace(" ", sep))
+    return patterns
+
+def sitemap_patterns(keywords):
+    """
+    In:     list of keywords from find_keywords()
+    Out:    keyword_patterns() of the keywords, less GENERIC_KEYWORDS
+    """
+    return keyword_patterns([kw for kw in keywords if kw not in GENERIC_KEYWORDS])
+
+def sitemap_rank(url, patterns):
+    """
+    In:     url - url listed in a sitemap
+            patterns - sitemap_patterns() of the keywords
+    Out:    0 for a url mentioning "privacy" (when it is a keyword), 1 for
+            one matching another keyword, None if it matches none
+    """
+    url = url.lower()
+    if "privacy" in patterns and "privacy" in url:
+        return 0
+    if any(pattern in url for pattern in patterns):
+        return 1
+    return None
+
+def discover_sitemap_links(full_url, keywords, max_sitemaps=MAX_SITEMAPS, max_urls=MAX_URLS, max_links=MAX_LINKS):
+    """
+    Find policy links in a site's sitemaps.  The sitemaps listed in
+    robots.txt are used, or /sitemap.xml if there are none.  Sitemap
+    indexes are followed breadth first.  A url is a candidate when it
+    contains one of the keywords, with spaces in the keyword also matched
+    as "-", "_" or nothing; GENERIC_KEYWORDS are left out, since they
+    would fill the list with e.g. help centre pages.  Urls mentioning
+    "privacy" come first, the rest in sitemap order.
+    In:     full_url - landing page url, e.g. https://www.domain.com
+            keywords - list of keywords from find_keywords()
+    Out:    list of candidate policy urls, [] if the sitemaps had none
+    """
+    patterns = sitemap_patterns(keywords)
+    sitemaps = find_sitemaps(full_url)
+    if sitemaps is None:
+        return []   # unreachable, don't wait on a second timeout for /sitemap.xml
+    if sitemaps == []:
+        sitemaps = [full_url + "/sitemap.xml"]
+    visited = set()
+    ranked = ([], [])   # privacy urls, other keyword urls
+    scanned = 0
+    while len(sitemaps) > 0 and len(visited) < max_sitemaps:
+        sitemap_url = sitemaps.pop(0)
+        if sitemap_url in visited:
+            continue
+        visited.add(sitemap_url)
+        for kind, url in iter_sitemap(sitemap_url):
+            if kind == "sitemap":
+                sitemaps.append(url)
+                continue
+            scanned += 1
+            rank = sitemap_rank(url, patterns)
+            if rank is not None and len(ranked[rank]) < max_links and url not in ranked[rank]:
+                ranked[rank].append(url)
+            if len(ranked[0]) >= max_links or scanned >= max_urls:
+                return (ranked[0] + ranked[1])[:max_links]
+    return (ranked[0] + ranked[1])[:max_links]
@@ -6,19 +6,19 @@ Created on Fri May 28 09:48:52 2021
 @author: yerui
 """
 
-import argparse, os, requests
-import pickle, psutil, logging
+import argparse, json, os, re, requests, threading
+import pickle, logging
 from urllib3.exceptions import NewConnectionError
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
-from selenium import webdriver
-from selenium.webdriver.firefox.options import Options
 from time import sleep
-from selenium.webdriver.support import ui
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
+from urllib.parse import urlparse
 import traceback
 
+# selenium and psutil are only imported inside the functions that drive the
+# browser; most runs never need them, and every pool worker would otherwise
+# pay for the import before crawling anything.
+
 class VerifyJsonExtension(argparse.Action):
     """
     Checks the input file that it is actually a file with
@@ -74,6 +74,7 @@ def create_driver_session(session_id, executor_url):
     @Rui
     Creat a driver session 
     """     
+    from selenium import webdriver
     from selenium.webdriver.remote.webdriver import WebDriver as RemoteWebDriver
 
     # Save the original function, so we can revert our patch
@@ -113,6 +114,9 @@ class myfox():
         """
         Instatiate a selenium Firefox webdriver, return it.
         """
+        from selenium import webdriver
+        from selenium.webdriver.firefox.options import Options
+
         options = Options()
         options.binary_location = r"myenv/bin/firefox/firefox"
         options.add_argument("--headless")  
@@ -149,6 +153,8 @@ class myfox():
         If trior fails, delete the running geckodriver, and start a now selenium Firefox webdriver 
         If the geckodriver isn't running, creat a now selenium Firefox webdriver.         
         """
+        import psutil
+
         p_name = [psutil.Process(i).name() for i in psutil.pids()]#check all running process
         if 'geckodriver' not in p_name:
             print("creat firefox")
@@ -165,6 +171,8 @@ class myfox():
                 driver = self.creatfirefox()
         return driver
 
+SELENIUM_LOCK = threading.Lock()
+
 def selenium_get(url):
     """
     @Rui
@@ -174,51 +182,294 @@ def selenium_get(url):
     Out:    requests_res - content of the request 
             all_links - all links found on the destination webpage. 
     """    
-    #try to restart selenium after error     
-    requests_res = ""
-    all_links = []
+    from selenium.webdriver.support import ui
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.common.by import By
+
+    # every render in the process shares one browser session, and
+    # create_driver_session() patches the webdriver class while attaching
+    # to it, so renders from the pipeline's fetch threads take turns
+    with SELENIUM_LOCK:
+        #try to restart selenium after error     
+        requests_res = ""
+        all_links = []
     
-    try: 
-        driver = myfox().work()
-        driver.get(url)
-        # execute script to scroll down the page
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);var lenOfPage=document.body.scrollHeight;return lenOfPage;")
-        # sleep for 10s
-        sleep(10)
+        try: 
+            driver = myfox().work()
+            driver.get(url)
+            # execute script to scroll down the page
+            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);var lenOfPage=document.body.scrollHeight;return lenOfPage;")
+            # sleep for 10s
+            sleep(10)
         
-        requests_res = driver.page_source
+            requests_res = driver.page_source
         
-        urls = ui.WebDriverWait(driver, 10).until(EC.presence_of_all_elements_located((By.TAG_NAME, "a")))
-        all_links = [url.get_attribute("href") for url in urls]
+            urls = ui.WebDriverWait(driver, 10).until(EC.presence_of_all_elements_located((By.TAG_NAME, "a")))
+            all_links = [url.get_attribute("href") for url in urls]
 
-    except Exception as e:
-        sleep(2)
-        print (traceback.format_exc())
-    finally:
-        sleep(2)
-        driver.refresh()
+        except Exception as e:
+            sleep(2)
+            print (traceback.format_exc())
+        finally:
+            sleep(2)
+            driver.refresh()
         
-        if requests_res == "":
-            print("\tselenium failed for " + url + " -> failed")
-        else:
-            print("\tselenium SUCCESS! for " + url)
+            if requests_res == "":
+                print("\tselenium failed for " + url + " -> failed")
+            else:
+                print("\tselenium SUCCESS! for " + url)
             
-        return requests_res, all_links
+            return requests_res, all_links
+
+# browser-like headers sent with every plain HTTP request
+REQUEST_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:29.1) Gecko/20100101 Firefox/88.0",
+    "Upgrade-Insecure-Requests": "1",
+    "DNT": "1",
+    "Accept": "*/*",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Accept-Encoding": "gzip, deflate"
+}
+
+# content types that can hold a policy; a missing Content-Type is let through
+ACCEPTED_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+MAX_CONTENT_BYTES = 5 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+META_CHARSET = re.compile(br"""<meta[^>]+charset=["']?([\w.:-]+)""", re.IGNORECASE)
+
+def count_reject(rejects, reason):
+    """
+    Tally why a page was dropped before verification, if the caller keeps count.
+    """
+    if rejects is not None:
+        rejects[reason] += 1
+
+def check_headers(response, max_bytes):
+    """
+    Reject responses that cannot be a policy from their headers alone,
+    before any of the body is downloaded.
+    In:     response - streamed requests response
+            max_bytes - largest body we are willing to download
+    Out:    rejection reason string, None if the body should be read
+    """
+    content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if content_type != "" and content_type not in ACCEPTED_CONTENT_TYPES:
+        return "content_type"
+    content_length = response.headers.get("Content-Length", "")
+    if content_length.isdigit() and int(content_length) > max_bytes:
+        return "content_length"
+    return None
+
+def read_body(response, max_bytes, chunk_size=CHUNK_SIZE):
+    """
+    Stream the body of a response, giving up once it grows past max_bytes.
+    In:     response - streamed requests response
+            max_bytes - largest body we are willing to download
+    Out:    body bytes, None if the body was larger than max_bytes
+    """
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        size += len(chunk)
+        if size > max_bytes:
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def detect_charset(response, body):
+    """
+    Pick the charset to decode a body with: the Content-Type header first,
+    then a <meta> charset declaration, then a guess from the first chunk.
+    In:     response - requests response the body came from
+            body - body bytes
+    Out:    name of the charset
+    """
+    content_type = response.headers.get("Content-Type", "")
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset" and value.strip():
+            return value.strip().strip("\"'")
+    first_chunk = body[:CHUNK_SIZE]
+    match = META_CHARSET.search(first_chunk)
+    if match:
+        return match.group(1).decode("ascii")
+    import chardet
+    return chardet.detect(first_chunk)["encoding"] or "utf-8"
+
+def decode_body(body, charset):
+    """
+    Decode body bytes, falling back to utf-8 for charsets Python doesn't know.
+    """
+    try:
+        return body.decode(charset, errors="replace")
+    except LookupError:     # unknown charset name
+        return body.decode("utf-8", errors="replace")
+
+def get_validators(response):
+    """
+    Out:    dict of the response's cache validators (ETag, Last-Modified),
+            used to revalidate the page with a conditional request later
+    """
+    return {"etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")}
+
+# how a host has to be fetched, remembered per host for the rest of the run
+STATIC = "static"               # plain requests.get() gets the page
+JS_REQUIRED = "js"              # only a rendered page has any content
+BLOCKED = "blocked"             # neither requests nor selenium get through
+OUTCOMES = (STATIC, JS_REQUIRED, BLOCKED)
+MODE_EVIDENCE = 3               # consistent fetches needed before a host skips plain requests
+REPROBE_INTERVAL = 20           # every Nth fetch to a js/blocked host tries requests again
+BLOCKED_STATUSES = (401, 403, 429)   # bot walls worth retrying with a real browser
+JS_SHELL_BODY_LENGTH = 20 * 1024   # bodies this small with a <noscript> warning may be an unrendered app shell
+SPA_MARKERS = ('<div id="root"></div>', '<div id="app"></div>', '<div id="__next"></div>',
+               "<app-root></app-root>", "ng-version=")
+NOSCRIPT_WARNING = re.compile(r"<noscript[^>]*>[^<]*(enable javascript|javascript is (required|disabled)|requires javascript|turn on javascript)")
+
+def needs_javascript(html):
+    """
+    Cheap guess from a plain HTTP response, without parsing it, whether
+    the page only has content once rendered: an empty body, an empty
+    single-page-app mount point, or a small page with a <noscript>
+    warning.  Pages that turn out to strip to no text at all are sent
+    back to selenium by the crawler, after they have been parsed anyway.
+    In:     html - body of the response
+    Out:    boolean of whether to render the page with selenium
+    """
+    if html.strip() == "":
+        return True
+    lowered = html.lower()
+    if any(marker in lowered for marker in SPA_MARKERS):
+        return True
+    return len(html) < JS_SHELL_BODY_LENGTH and NOSCRIPT_WARNING.search(lowered) is not None
+
+def mark_rendered(validators):
+    """
+    Note in a page's validators that it was fetched with selenium, so the
+    HTTP validators of the unrendered page don't describe it.
+    """
+    if validators is not None:
+        validators.clear()
+        validators["rendered"] = True
+
+def classify_host(static, js, failed):
+    """
+    Judge how a host has to be fetched from how its pages came back so
+    far.  A host only goes straight to selenium once MODE_EVIDENCE pages
+    needed rendering and they outnumber the pages plain requests got, and
+    is only skipped as blocked once MODE_EVIDENCE fetches failed with none
+    ever succeeding, so one empty or dead link never downgrades a host.
+    In:     numbers of the host's pages that came back with plain HTTP,
+            only once rendered, and not at all
+    Out:    render mode, None if there is too little evidence
+    """
+    if js >= MODE_EVIDENCE and js > static:
+        return JS_REQUIRED
+    if failed >= MODE_EVIDENCE and static == 0 and js == 0:
+        return BLOCKED
+    if static > 0:
+        return STATIC
+    return None
+
+class RenderModes():
+    """
+    How hosts have to be fetched.  Every process counts how its own
+    fetches to a host came back and classifies the host from those counts
+    with classify_host().  The mode is only written to the shared dict when
+    it changes, so processes and nodes learn from each other without a
+    shared write per fetch; hosts this process has no verdict on yet use
+    the shared mode.  Safe to use from several threads.
+    """
+    def __init__(self, shared=None):
+        self.shared = shared if shared is not None else {}  # host -> mode, shared by every process
+        self.counts = {}        # host -> [fetches, static, js, failed] pages of this process
+        self.modes = {}         # host -> mode last read from or written to shared
+        self.lock = threading.Lock()
+
+    def fetch(self, host):
+        """
+        Count a fetch to the host.
+        Out:    (render mode or None if unknown, whether this fetch should
+                try plain HTTP again regardless of the mode)
+        """
+        with self.lock:
+            if host not in self.counts:
+                self.counts[host] = [0, 0, 0, 0]
+                try:
+                    self.modes[host] = self.shared[host]
+                except KeyError:
+                    self.modes[host] = None
+            counts = self.counts[host]
+            counts[0] += 1
+            return classify_host(*counts[1:]) or self.modes[host], counts[0] % REPROBE_INTERVAL == 0
+
+    def outcome(self, host, outcome):
+        """
+        Count how a fetched page came back, one of OUTCOMES, and publish
+        the host's mode if that changed it.
+        """
+        with self.lock:
+            counts = self.counts.setdefault(host, [0, 0, 0, 0])
+            counts[1 + OUTCOMES.index(outcome)] += 1
+            mode = classify_host(*counts[1:])
+            if mode is None or mode == self.modes.get(host):
+                return
+            self.modes[host] = mode
+        self.shared[host] = mode
 
-def request(url):
+def load_render_modes(render_modes_file, render_modes):
+    """
+    Seed the shared render modes with the host modes saved by an earlier run.
+    """
+    if os.path.isfile(render_modes_file):
+        with open(render_modes_file, "r") as fp:
+            for host, mode in json.load(fp).items():
+                render_modes.shared[host] = mode
+
+def save_render_modes(render_modes_file, render_modes):
+    """
+    Save the host modes of this run for the next one.
+    """
+    with open(render_modes_file, "w") as fp:
+        json.dump(dict(render_modes.shared.items()), fp)
+
+def request(url, max_bytes=MAX_CONTENT_BYTES, rejects=None, validators=None, render_modes=None, render=False):
     """
     @Rui
     Makes a simple HTTP request to the specified url and returns its
-    contents. If it fails, make a selenium request instead.
+    contents. If it fails, make a selenium request instead.  Responses
+    whose headers show they are not html, or whose body is larger than
+    max_bytes, are dropped without falling back to selenium.  When given
+    render_modes, hosts known to need javascript go straight to selenium
+    and blocked hosts are skipped, apart from an occasional re-probe.
     
-    In:     destination of http request           
+    In:     url - destination of http request           
+            max_bytes - cap on the downloaded body size
+            rejects - optional Counter tallying why responses were dropped
+            validators - optional dict filled with the response's ETag and
+                         Last-Modified headers, or {"rendered": True} for
+                         a page fetched with selenium
+            render_modes - optional RenderModes, read and updated by
+                           every request
+            render - skip plain HTTP and render the page with selenium
     Out:    requests_res - content of the request 
             all_links - with selenium request, return all links on the destination
                         webpage. If it is the HTTP request, return []. 
     """
-    from verification.verify import strip_text
     requests_res = ""
     all_links = []
+    host = urlparse(url).netloc.lower()
+    mode, reprobe = render_modes.fetch(host) if render_modes is not None else (None, False)
+    if mode == BLOCKED and not reprobe:
+        count_reject(rejects, "blocked_host")
+        return "", []
+    if render or (mode == JS_REQUIRED and not reprobe):
+        requests_res, all_links = selenium_get(url)
+        if render_modes is not None:
+            render_modes.outcome(host, JS_REQUIRED if requests_res != "" else BLOCKED)
+        mark_rendered(validators)
+        return requests_res, all_links
+
     exceptions = (requests.exceptions.ReadTimeout,
                   requests.exceptions.ConnectTimeout,
                   requests.ConnectionError,
@@ -227,33 +478,76 @@ def request(url):
                   ConnectionAbortedError,
                   ConnectionResetError)
     try:
-        user_agent = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:73.0) Gecko/20100101 Firefox/73.0"
-        user_agent = "Mozilla/5.0 (X11; Linux x86_64; rv:29.1) Gecko/20100101 Firefox/88.0"
-        accept = "*/*"
-        accept_language = "en-US,en;q=0.5"
-        accept_encoding = "gzip, deflate"
-        dnt = "1"
-        up_insecure_reqs = "1"
-        headers = {
-            "User-Agent": user_agent,
-            "Upgrade-Insecure-Requests": up_insecure_reqs,
-            "DNT": dnt,"Accept": accept,
-            "Accept-Language": accept_language,
-            "Accept-Encoding": accept_encoding
-        }        
-        requests_res = requests.get(url, headers=headers, timeout=(3,6))
-        requests_res = requests_res.text
+        with requests.get(url, headers=REQUEST_HEADERS, timeout=(3,6), stream=True) as response:
+            status = response.status_code
+            reason = check_headers(response, max_bytes)
+            if reason is None:
+                body = read_body(response, max_bytes)
+                if body is None:
+                    reason = "body_too_large"
+            if reason is not None:
+                count_reject(rejects, reason)
+                return "", []
+            requests_res = decode_body(body, detect_charset(response, body))
+            if validators is not None:
+                validators.update(get_validators(response))
         
-        if not requests_res or not strip_text(requests_res):
+        if status in BLOCKED_STATUSES or needs_javascript(requests_res):
             print("requests failed for " + url + " -> trying selenium")
             requests_res, all_links = selenium_get(url)
+            mark_rendered(validators)
+            outcome = JS_REQUIRED if requests_res != "" else BLOCKED
+        else:
+            outcome = STATIC
+        if render_modes is not None:
+            render_modes.outcome(host, outcome)
 
     except requests.exceptions.ConnectionError as e:
         print("REQUESTS connection refused for " + url)
     except (exceptions) as e:
         print("REQUEST PROBLEM: " + str(e))
-        return ""
+        return "", []
     except Exception as e:
         print("UNKNOWN PROBLEM: " + str(e))
 
-    return requests_res, all_links
\ No newline at end of file
+    return requests_res, all_links
+
+def conditional_request(url, validators, max_bytes=MAX_CONTENT_BYTES):
+    """
+    Revalidate a previously fetched page.  Sends the ETag / Last-Modified
+    we saw last time so an unchanged page costs a 304 and no body.  A page
+    that was rendered with selenium last time is rendered again, since the
+    unrendered HTML would never match its fingerprint; otherwise this never
+    falls back to selenium.
+
+    In:     url - page to revalidate
+            validators - dict of "etag" and "last_modified" from the last
+                         fetch, or {"rendered": True}
+            max_bytes - cap on the downloaded body size
+    Out:    status - HTTP status code, 0 if the request failed
+            requests_res - content of the page, "" unless status is 200
+            validators - the page's current validators
+    """
+    if validators.get("rendered"):
+        requests_res, all_links = selenium_get(url)
+        if requests_res == "":
+            return 0, "", {}
+        return 200, requests_res, validators
+    headers = dict(REQUEST_HEADERS)
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    try:
+        with requests.get(url, headers=headers, timeout=(3,6), stream=True) as response:
+            if response.status_code == 304:
+                return 304, "", validators
+            if response.status_code != 200 or check_headers(response, max_bytes) is not None:
+                return response.status_code, "", {}
+            body = read_body(response, max_bytes)
+            if body is None:
+                return response.status_code, "", {}
+            return 200, decode_body(body, detect_charset(response, body)), get_validators(response)
+    except Exception as e:
+        print("REVALIDATION PROBLEM: " + str(e))
+        return 0, "", {}
@@ -0,0 +1,282 @@
+"""
+Privacy Policy Project
+work_queue.py
+Durable work queue used to spread a crawl over several worker processes
+or machines.  The coordinator loads the domain list into a SQLite
+database; workers lease batches of domains, crawl them, and push their
+results and dedupe fingerprints back into the same database.  A lease
+that is not completed before its visibility timeout expires goes back
+to the queue, so a dead worker never loses domains.
+"""
+
+import hashlib, os, pickle, sqlite3, threading, time
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+class WorkQueue():
+    """
+    SQLite backed queue of domains to crawl.  Each process and thread opens
+    its own connection lazily, so a WorkQueue built in the coordinator can
+    be inherited by forked workers and used by their heartbeat threads.  Point several nodes at a database on a
+    shared filesystem to run them against the same queue; that needs
+    shared_fs=True, since SQLite's WAL mode relies on shared memory that
+    does not work across machines, and a filesystem whose POSIX (fcntl)
+    locks are honoured by every node.
+    """
+    def __init__(self, db_path, lease_timeout=600, max_attempts=3, shared_fs=False):
+        self.db_path = db_path
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.journal_mode = "DELETE" if shared_fs else "WAL"
+        self._local = threading.local()
+        self._create_tables()
+
+    def _connect(self):
+        """
+        Return this thread's connection, reopening it after a fork.
+        """
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+            self._local.conn.execute("PRAGMA journal_mode=" + self.journal_mode)
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def _create_tables(self):
+        conn = self._connect()
+        conn.execute("""CREATE TABLE IF NOT EXISTS tasks (
+                            id INTEGER PRIMARY KEY,
+                            domain TEXT UNIQUE,
+                            policy TEXT,
+                            state TEXT,
+                            owner TEXT,
+                            lease_expires REAL,
+                            attempts INTEGER DEFAULT 0,
+                            result BLOB)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, lease_expires)")
+        conn.execute("""CREATE TABLE IF NOT EXISTS fingerprints (
+                            name TEXT,
+                            fingerprint TEXT,
+                            value BLOB,
+                            PRIMARY KEY (name, fingerprint))""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS meta (
+                            key TEXT PRIMARY KEY,
+                            value TEXT)""")
+
+    def load(self, domain_zips):
+        """
+        Add (domain, true policy link) pairs to the queue.  Domains that
+        are already queued keep their state, so loading the same list
+        again resumes a run instead of restarting it.
+        In:     iterable of (domain, policy) tuples
+        Out:    n/a
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("INSERT OR IGNORE INTO tasks (domain, policy, state) VALUES (?, ?, ?)",
+                         ((domain, policy, PENDING) for domain, policy in domain_zips))
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('loaded', '1')")
+        conn.execute("COMMIT")
+
+    def loaded(self):
+        """
+        Out:    whether a coordinator has loaded the domain list yet, so
+                workers started first don't mistake the empty queue for a
+                drained one
+        """
+        conn = self._connect()
+        return conn.execute("SELECT 1 FROM meta WHERE key = 'loaded'").fetchone() is not None
+
+    def lease(self, owner, batch_size=10):
+        """
+        Lease up to batch_size domains that are pending or whose previous
+        lease has expired.
+        In:     owner - worker id recorded on the lease
+                batch_size - max number of domains to hand out
+        Out:    list of (task id, domain, policy, attempt number) tuples, []
+                if none are free
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._reclaim(conn, now)
+            rows = conn.execute("SELECT id, domain, policy, attempts + 1 FROM tasks WHERE state = ? ORDER BY id LIMIT ?",
+                                (PENDING, batch_size)).fetchall()
+            conn.executemany("UPDATE tasks SET state = ?, owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                             ((LEASED, owner, now + self.lease_timeout, row[0]) for row in rows))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def reclaim(self):
+        """
+        Return expired leases to the queue.  Workers do this on every lease;
+        the coordinator also calls it while waiting so that a run whose
+        workers all died still finishes its bookkeeping.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        self._reclaim(conn, time.time())
+        conn.execute("COMMIT")
+
+    def _reclaim(self, conn, now):
+        # expired leases that used up their attempts are given up on
+        conn.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, owner = NULL WHERE state = ? AND lease_expires < ?",
+                     (self.max_attempts, FAILED, PENDING, LEASED, now))
+
+    def extend(self, owner, task_ids):
+        """
+        Push back the visibility timeout of leases still held by owner.
+        Called by a worker's heartbeat while it crawls a batch.
+        """
+        conn = self._connect()
+        conn.executemany("UPDATE tasks SET lease_expires = ? WHERE id = ? AND owner = ? AND state = ?",
+                         ((time.time() + self.lease_timeout, task_id, owner, LEASED) for task_id in task_ids))
+
+    def complete(self, owner, task_id, result, attempts=()):
+        """
+        Store the pickled result of a crawled domain, together with the
+        fingerprints its attempt added.  A worker whose lease was reclaimed
+        by someone else neither overwrites their result nor publishes its
+        fingerprints.
+        In:     owner, task_id - the lease
+                result - result of the domain
+                attempts - AttemptDicts the domain was crawled with
+        Out:    whether the result was stored
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            stored = conn.execute("UPDATE tasks SET state = ?, result = ?, owner = NULL WHERE id = ? AND owner = ? AND state = ?",
+                                  (DONE, pickle.dumps(result), task_id, owner, LEASED)).rowcount == 1
+            if stored:
+                for attempt in attempts:
+                    conn.executemany("INSERT OR REPLACE INTO fingerprints (name, fingerprint, value) VALUES (?, ?, ?)",
+                                     ((attempt.shared.name, attempt.shared._key(key), pickle.dumps(value))
+                                      for key, value in attempt.pending.items()))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return stored
+
+    def fail(self, owner, task_id):
+        """
+        Release a lease after an error.  The domain is retried until it has
+        been leased max_attempts times.  The failed attempt's fingerprints
+        are never completed, so the retry starts from a clean slate.
+        """
+        conn = self._connect()
+        conn.execute("""UPDATE tasks SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, owner = NULL
+                        WHERE id = ? AND owner = ? AND state = ?""",
+                     (self.max_attempts, FAILED, PENDING, task_id, owner, LEASED))
+
+    def counts(self):
+        """
+        Out:    dict of task state -> number of domains in that state
+        """
+        conn = self._connect()
+        return dict(conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+    def unfinished(self):
+        """
+        Out:    number of domains that are neither done nor failed
+        """
+        conn = self._connect()
+        return conn.execute("SELECT COUNT(*) FROM tasks WHERE state IN (?, ?)", (PENDING, LEASED)).fetchone()[0]
+
+    def domains(self):
+        """
+        Out:    list of every queued domain, in load order
+        """
+        conn = self._connect()
+        return [row[0] for row in conn.execute("SELECT domain FROM tasks ORDER BY id")]
+
+    def results(self):
+        """
+        Out:    list of (domain, policy, unpickled result or None), in load
+                order.  None marks a domain that failed on every attempt.
+        """
+        conn = self._connect()
+        rows = conn.execute("SELECT domain, policy, result FROM tasks ORDER BY id").fetchall()
+        return [(domain, policy, pickle.loads(result) if result is not None else None)
+                for domain, policy, result in rows]
+
+    def fingerprint_dict(self, name):
+        """
+        Out:    dict-like view of the named fingerprint table, shared by
+                every worker on the queue.
+        """
+        return FingerprintDict(self, name)
+
+class FingerprintDict():
+    """
+    Minimal dict stand-in backed by the fingerprints table, so the shared
+    policy_dict and link_dict of crawler.py work unchanged across nodes.
+    Keys are stored as sha1 fingerprints rather than the full policy text.
+    """
+    def __init__(self, work_queue, name):
+        self.work_queue = work_queue
+        self.name = name
+
+    def _key(self, key):
+        return hashlib.sha1(str(key).encode("utf-8")).hexdigest()
+
+    def __contains__(self, key):
+        conn = self.work_queue._connect()
+        row = conn.execute("SELECT 1 FROM fingerprints WHERE name = ? AND fingerprint = ?",
+                           (self.name, self._key(key))).fetchone()
+        return row is not None
+
+    def __getitem__(self, key):
+        conn = self.work_queue._connect()
+        row = conn.execute("SELECT value FROM fingerprints WHERE name = ? AND fingerprint = ?",
+                           (self.name, self._key(key))).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return pickle.loads(row[0])
+
+    def __setitem__(self, key, value):
+        conn = self.work_queue._connect()
+        conn.execute("INSERT OR REPLACE INTO fingerprints (name, fingerprint, value) VALUES (?, ?, ?)",
+                     (self.name, self._key(key), pickle.dumps(value)))
+
+    def __len__(self):
+        conn = self.work_queue._connect()
+        return conn.execute("SELECT COUNT(*) FROM fingerprints WHERE name = ?", (self.name,)).fetchone()[0]
+
+    def attempt(self):
+        """
+        Out:    AttemptDict over this table for crawling one domain
+        """
+        return AttemptDict(self)
+
+class AttemptDict():
+    """
+    Fingerprints seen while crawling one leased domain.  Lookups see the
+    shared table plus this attempt's own additions; the additions are
+    only written to the shared table by WorkQueue.complete(), so a failed
+    or reclaimed attempt leaves nothing behind for the retry to trip over.
+    """
+    def __init__(self, shared):
+        self.shared = shared
+        self.pending = {}
+
+    def __contains__(self, key):
+        return key in self.pending or key in self.shared
+
+    def __getitem__(self, key):
+        if key in self.pending:
+            return self.pending[key]
+        return self.shared[key]
+
+    def __setitem__(self, key, value):
+        self.pending[key] = value
+
+    def __len__(self):
+        return len(self.shared) + sum(1 for key in self.pending if key not in self.shared)
@@ -4,15 +4,55 @@ verify.py
 Checks every file in list of given webpages is actually a privacy
 policy.  
 Checks wether the text is majority english, then does 
-cosine similarity from ground truth using TfidfVectorizer.
+cosine similarity from ground truth, weighted the way
+TfidfVectorizer weighs the ground truth and one document.
 Currently seems like ~60% is the cutoff.
 """
 
+import hashlib
+import math
 import os 
 import re
 from bs4 import BeautifulSoup
+from collections import Counter
 from utils.utils import request
 
+# same tokens TfidfVectorizer() extracts with its default settings
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+# smoothed idf of a term found in only one of the two compared documents,
+# ln((1 + 2) / (1 + 1)) + 1; a term found in both has an idf of exactly 1
+ONE_DOC_IDF = math.log(1.5) + 1
+
+# terms nearly every privacy policy uses; pages with almost none of them are
+# rejected before the (much slower) english check and similarity score
+POLICY_TERMS = frozenset(["privacy", "personal", "data", "information", "cookies",
+                          "cookie", "consent", "processing", "collect", "rights",
+                          "third", "parties", "policy", "disclose", "retention"])
+MIN_POLICY_LENGTH = 500
+MIN_POLICY_TERM_DENSITY = 0.01
+
+class GroundTruth():
+    """
+    Sparse centroid of the ground truth corpus: raw term counts of every
+    ground truth policy combined, plus the squared norm of those counts.
+    Terms are kept as a sorted array of 64 bit term hashes next to an
+    array of their counts, rather than as a dict of python objects, so the
+    centroid is compact and forked workers read the parent's pages without
+    touching reference counts and copying them.
+    """
+    __slots__ = ("hashes", "counts", "sq_norm")
+
+    def __init__(self, counts):
+        import numpy as np
+        hashes = hash_terms(counts)
+        order = np.argsort(hashes)
+        self.hashes = hashes[order]
+        self.counts = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))[order]
+        self.hashes.flags.writeable = False
+        self.counts.flags.writeable = False
+        self.sq_norm = float(np.dot(self.counts, self.counts))
+
 def load_dictionary(dictionary):
     dictionaryFile = open(dictionary)
     ENGLISH_WORDS = {}
@@ -111,25 +151,105 @@ def remove_company_names(html_contents, name):
     html_contents = re.sub(name, " ", html_contents, flags=re.IGNORECASE)
     return html_contents
 
+def count_terms(text):
+    """
+    In:     string of stripped policy text
+    Out:    Counter of the lowercased terms in the text
+    """
+    return Counter(TOKEN_PATTERN.findall(text.lower()))
+
+def hash_terms(terms):
+    """
+    In:     iterable of terms
+    Out:    numpy uint64 array of a stable 64 bit hash of every term, the
+            same in every process unlike hash()
+    """
+    import numpy as np
+    digests = b"".join(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest() for term in terms)
+    return np.frombuffer(digests, dtype="<u8").astype(np.uint64)
+
 def get_ground_truth(ground_truth_html_dir):
     """
-    This function builds one massive ground truth string containing
-    the relevant text of all html documents in the ground truth
-    corpus.  These policies have been reviewed by a human to verify
-    they contain privacy policies.  The dataset has been expanded after
-    various experiments showed policies on the edge of acceptable
-    cosine similarity.
+    This function builds the ground truth centroid from the relevant text
+    of all html documents in the ground truth corpus.  These policies have
+    been reviewed by a human to verify they contain privacy policies.  The
+    dataset has been expanded after various experiments showed policies on
+    the edge of acceptable cosine similarity.  Each policy's terms are
+    counted as soon as it is read, so only one document's text is ever in
+    memory no matter how large the corpus grows.
 
     In:     n/a, ground_truth_html_dir directory set in main
-    Out:    string containing text of all ground truth policy html docs
+    Out:    GroundTruth centroid of all ground truth policy html docs
     """
-    ground_truth = ""
+    counts = Counter()
     for policy in os.listdir(ground_truth_html_dir):
         with open(ground_truth_html_dir + policy, "rb") as fp:
             html_contents = fp.read()
-        html_contents = remove_company_names(strip_text(html_contents), policy[:-5]) + " "
-        ground_truth += html_contents
-    return ground_truth
+        counts.update(count_terms(remove_company_names(strip_text(html_contents), policy[:-5])))
+    return GroundTruth(counts)
+
+def prefilter_text(html_contents, min_length=MIN_POLICY_LENGTH, min_density=MIN_POLICY_TERM_DENSITY):
+    """
+    Cheap checks that throw out obvious non-policies (login walls, error
+    pages, image galleries) before is_english() and the similarity score.
+
+    In:     html_contents - stripped html text
+            min_length - minimum number of characters in a policy
+            min_density - minimum fraction of words that are POLICY_TERMS
+    Out:    rejection reason string, None if the text may be a policy
+    """
+    if len(html_contents) < min_length:
+        return "too_short"
+    words = TOKEN_PATTERN.findall(html_contents.lower())
+    policy_words = sum(1 for word in words if word in POLICY_TERMS)
+    if len(words) == 0 or float(policy_words) / len(words) < min_density:
+        return "low_policy_term_density"
+    return None
+
+def ground_truth_similarity(ground_truth, html_contents):
+    """
+    Cosine similarity between the ground truth and a document, weighted
+    the way TfidfVectorizer weighs a corpus of just those two documents.
+    Terms the ground truth and the document share get an idf of 1, and
+    terms unique to either get ONE_DOC_IDF.  Only the document's own terms
+    are looked up, with a binary search of their hashes in the centroid;
+    the ground truth's norm is corrected from its precomputed total for
+    the few terms the two have in common.
+
+    In:     ground_truth - GroundTruth centroid
+            html_contents - stripped html text
+    Out:    cosine similarity score of ground truth and policy document
+    """
+    doc_counts = count_terms(html_contents)
+    if len(doc_counts) == 0 or ground_truth.sq_norm == 0:
+        return 0.0
+
+    import numpy as np
+    counts = np.fromiter(doc_counts.values(), dtype=np.float64, count=len(doc_counts))
+    hashes = hash_terms(doc_counts)
+    position = np.minimum(np.searchsorted(ground_truth.hashes, hashes), len(ground_truth.hashes) - 1)
+    shared = ground_truth.hashes[position] == hashes
+    gt_shared = ground_truth.counts[position[shared]]
+    doc_shared = counts[shared]
+    doc_unique = counts[~shared]
+
+    dot = float(np.dot(gt_shared, doc_shared))
+    shared_sq = float(np.dot(gt_shared, gt_shared))    # sum of squared ground truth counts of shared terms
+    doc_shared_sq = float(np.dot(doc_shared, doc_shared))
+    doc_unique_sq = float(np.dot(doc_unique, doc_unique))
+
+    idf_sq = ONE_DOC_IDF * ONE_DOC_IDF
+    gt_norm = math.sqrt(idf_sq * (ground_truth.sq_norm - shared_sq) + shared_sq)
+    doc_norm = math.sqrt(doc_shared_sq + idf_sq * doc_unique_sq)
+    return dot / (gt_norm * doc_norm)
+
+def fingerprint_text(html_contents):
+    """
+    In:     stripped html text
+    Out:    hex digest identifying the text, to tell whether a policy
+            changed between two crawls without keeping the old text around
+    """
+    return hashlib.sha1(html_contents.encode("utf-8")).hexdigest()
 
 def is_duplicate_policy(link_contents, domain, policy_dict):
     """
@@ -0,0 +1,9 @@
+"""
+Privacy Policy Project
+Tests run against the modules in src/, imported the way crawler.py
+imports them.
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
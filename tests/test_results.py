@@ -0,0 +1,85 @@
+"""
+Privacy Policy Project
+Table-driven tests for the summary's result table and the choice of each
+domain's policy link.
+"""
+
+import pytest
+import crawler
+from crawler import build_result_table, find_policy_link, from_record, to_record, CrawlReturn
+
+def crawl_return(domain, links):
+    """
+    In:     domain - domain name
+            links - list of (link, sim_score, access_success, valid, duplicate)
+    Out:    CrawlReturn object holding the links
+    """
+    retobj = CrawlReturn(domain, len(links) > 0, None)
+    for output, (link, sim_score, access_success, valid, duplicate) in enumerate(links):
+        retobj.add_link(link, sim_score, output + 1 if valid else 0, access_success, valid, duplicate)
+    return retobj
+
+# (description, domains as (domain, links), expected (policy link, score) per domain)
+CASES = [
+    ("highest score wins",
+     [("a.com", [("https://a.com/terms", 0.41, True, False, False),
+                 ("https://a.com/privacy", 0.93, True, True, False)])],
+     [("https://a.com/privacy", 0.93)]),
+    ("first link wins a tie on the rounded score",
+     [("a.com", [("https://a.com/privacy", 0.904, True, True, False),
+                 ("https://a.com/policy", 0.896, True, True, False),
+                 ("https://a.com/legal", 0.9, True, True, False)])],
+     [("https://a.com/privacy", 0.9)]),
+    ("duplicates are skipped",
+     [("a.com", [("https://a.com/shared-policy", 0.95, True, True, True),
+                 ("https://a.com/privacy", 0.71, True, True, False)])],
+     [("https://a.com/privacy", 0.71)]),
+    ("off-domain links are skipped",
+     [("a.com", [("https://cdn.example.net/privacy", 0.99, True, True, False),
+                 ("https://a.com/privacy", 0.62, True, True, False)])],
+     [("https://a.com/privacy", 0.62)]),
+    ("links that were not accessed are skipped",
+     [("a.com", [("https://a.com/privacy", 0.99, False, False, False),
+                 ("https://a.com/cookies", 0.33, True, False, False)])],
+     [("https://a.com/cookies", 0.33)]),
+    ("scores rounding to zero never win",
+     [("a.com", [("https://a.com/privacy", 0.004, True, False, False)])],
+     [("", 0)]),
+    ("empty domains in between keep their place",
+     [("a.com", []),
+      ("b.com", [("https://b.com/privacy", 0.8, True, True, False)]),
+      ("c.com", []),
+      ("d.com", [("https://d.com/privacy", 0.5, True, True, False),
+                 ("https://b.com/privacy", 0.9, True, True, False)])],
+     [("", 0), ("https://b.com/privacy", 0.8), ("", 0), ("https://d.com/privacy", 0.5)]),
+    ("no domains at all",
+     [],
+     []),
+]
+
+@pytest.mark.parametrize("description, domains, expected", CASES, ids=[case[0] for case in CASES])
+def test_find_policy_link(description, domains, expected):
+    all_links = [crawl_return(domain, links) for domain, links in domains]
+    policy_links = find_policy_link(all_links, build_result_table(all_links))
+    assert policy_links == expected
+    assert all(isinstance(score, (int, float)) for _, score in policy_links)
+
+@pytest.mark.parametrize("description, domains, expected", CASES, ids=[case[0] for case in CASES])
+def test_build_result_table(description, domains, expected):
+    all_links = [crawl_return(domain, links) for domain, links in domains]
+    table = build_result_table(all_links)
+    assert table["n_links"].tolist() == [len(links) for _, links in domains]
+    assert table["domain_index"].tolist() == [d for d, (_, links) in enumerate(domains) for _ in links]
+    assert table["sim_score"].tolist() == [link[1] for _, links in domains for link in links]
+    assert table["n_valid"].tolist() == [sum(1 for link in links if link[3]) for _, links in domains]
+    assert table["sim_avg"].tolist() == pytest.approx([sum(link[1] for link in links) / len(links) if links else 0.0
+                                                       for _, links in domains])
+
+def test_record_round_trip(monkeypatch):
+    # output folders are set in crawler's main
+    monkeypatch.setattr(crawler, "html_outfolder", "html/", raising=False)
+    monkeypatch.setattr(crawler, "stripped_outfolder", "stripped_text/", raising=False)
+    retobj = crawl_return("a.com", CASES[1][1][0][1])
+    record = to_record(retobj)
+    assert record["outfolders"] == ["html/", "stripped_text/"]
+    assert to_record(from_record("a.com", record)) == record
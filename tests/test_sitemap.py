@@ -0,0 +1,172 @@
+"""
+Privacy Policy Project
+Tests for sitemap discovery, with robots.txt and sitemap bodies served by
+a stubbed requests.get instead of the network.
+"""
+
+import gzip
+import pytest
+import requests
+from utils import sitemap
+from utils.sitemap import discover_sitemap_links, iter_sitemap, sitemap_patterns, sitemap_rank
+
+SITE = "https://a.com"
+UK_KEYWORDS = ["privacy", "help", "policy", "policies"]
+
+def urlset(*urls):
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            + "".join("<url><loc>" + url + "</loc></url>" for url in urls)
+            + "</urlset>").encode("utf-8")
+
+def sitemapindex(*urls):
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            + "".join("<sitemap><loc>" + url + "</loc></sitemap>" for url in urls)
+            + "</sitemapindex>").encode("utf-8")
+
+class FakeResponse():
+    """
+    Streamed response serving a fixed body in small chunks, whatever
+    chunk size is asked for, so the parsing really is incremental.
+    """
+    def __init__(self, status_code, body, chunk_size):
+        self.status_code = status_code
+        self.body = body
+        self.chunk_size = chunk_size
+        self.headers = {}
+        self.read = 0
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), self.chunk_size):
+            self.read = start + self.chunk_size
+            yield self.body[start:start + self.chunk_size]
+
+@pytest.fixture
+def site(monkeypatch):
+    """
+    Dict of url -> body (or (status, body)) served by requests.get; urls
+    not in it get a 404, and site.requested lists every url fetched.
+    """
+    class Site(dict):
+        chunk_size = 7
+        unreachable = False
+    served = Site()
+    served.requested = []
+    served.responses = []
+    def get(url, headers=None, timeout=None, stream=False):
+        served.requested.append(url)
+        if served.unreachable:
+            raise requests.exceptions.ConnectionError("unreachable")
+        served_body = served.get(url, (404, b"not found"))
+        status, body = (200, served_body) if isinstance(served_body, bytes) else served_body
+        response = FakeResponse(status, body, served.chunk_size)
+        served.responses.append(response)
+        return response
+    monkeypatch.setattr(sitemap.requests, "get", get)
+    return served
+
+def test_robots_sitemap_lines(site):
+    site[SITE + "/robots.txt"] = (b"User-agent: *\nDisallow: /admin\n"
+                                  b"Sitemap: https://a.com/pages.xml\nsitemap:https://a.com/news.xml\n")
+    site[SITE + "/pages.xml"] = urlset("https://a.com/privacy-policy")
+    site[SITE + "/news.xml"] = urlset("https://a.com/news/cookie-policy")
+    assert discover_sitemap_links(SITE, UK_KEYWORDS) == ["https://a.com/privacy-policy", "https://a.com/news/cookie-policy"]
+    assert SITE + "/sitemap.xml" not in site.requested
+
+def test_falls_back_to_sitemap_xml(site):
+    site[SITE + "/robots.txt"] = b"User-agent: *\nDisallow:\n"
+    site[SITE + "/sitemap.xml"] = urlset("https://a.com/", "https://a.com/privacy")
+    assert discover_sitemap_links(SITE, UK_KEYWORDS) == ["https://a.com/privacy"]
+
+def test_unreachable_site_is_not_retried(site):
+    site.unreachable = True
+    assert discover_sitemap_links(SITE, UK_KEYWORDS) == []
+    assert site.requested == [SITE + "/robots.txt"]
+
+@pytest.mark.parametrize("name", ["sitemap.xml.gz", "sitemap.xml"])
+def test_gzip_detected_by_magic_bytes(site, name):
+    # servers label gzipped sitemaps inconsistently, so the name must not matter
+    site[SITE + "/" + name] = gzip.compress(urlset("https://a.com/about", "https://a.com/privacy"))
+    assert list(iter_sitemap(SITE + "/" + name)) == [("url", "https://a.com/about"), ("url", "https://a.com/privacy")]
+
+def test_plain_xml_is_not_decompressed(site):
+    site[SITE + "/sitemap.xml"] = urlset("https://a.com/privacy")
+    assert list(iter_sitemap(SITE + "/sitemap.xml")) == [("url", "https://a.com/privacy")]
+
+def test_not_xml(site):
+    site[SITE + "/sitemap.xml"] = b"<html><body>Page not found</body><p></html>"
+    assert list(iter_sitemap(SITE + "/sitemap.xml")) == []
+
+def test_index_followed(site):
+    site[SITE + "/robots.txt"] = b"Sitemap: https://a.com/index.xml\n"
+    site[SITE + "/index.xml"] = sitemapindex("https://a.com/a.xml.gz", "https://a.com/b.xml")
+    site[SITE + "/a.xml.gz"] = gzip.compress(urlset("https://a.com/shop", "https://a.com/legal/policies"))
+    site[SITE + "/b.xml"] = urlset("https://a.com/legal/privacy")
+    assert list(iter_sitemap(SITE + "/index.xml")) == [("sitemap", "https://a.com/a.xml.gz"), ("sitemap", "https://a.com/b.xml")]
+    assert discover_sitemap_links(SITE, UK_KEYWORDS) == ["https://a.com/legal/privacy", "https://a.com/legal/policies"]
+
+def test_index_loops_and_sitemap_cap(site):
+    site[SITE + "/robots.txt"] = b"Sitemap: https://a.com/index.xml\n"
+    site[SITE + "/index.xml"] = sitemapindex(*(["https://a.com/index.xml"] + ["https://a.com/%d.xml" % i for i in range(5)]))
+    for i in range(5):
+        site[SITE + "/%d.xml" % i] = urlset("https://a.com/%d/privacy" % i)
+    assert discover_sitemap_links(SITE, UK_KEYWORDS, max_sitemaps=3) == ["https://a.com/0/privacy", "https://a.com/1/privacy"]
+    assert site.requested.count(SITE + "/index.xml") == 1
+
+def test_byte_cap(site):
+    site[SITE + "/sitemap.xml"] = urlset(*["https://a.com/page%d" % i for i in range(100)])
+    entries = list(iter_sitemap(SITE + "/sitemap.xml", max_bytes=1000))
+    assert 0 < len(entries) < 100
+    assert site.responses[-1].read <= 1000 + site.chunk_size
+
+def test_byte_cap_applies_to_uncompressed_size(site):
+    # a small gzip that inflates past the cap is cut off all the same
+    body = urlset(*["https://a.com/page%d" % i for i in range(2000)])
+    site[SITE + "/sitemap.xml.gz"] = gzip.compress(body)
+    assert len(gzip.compress(body)) < 10000 < len(body)
+    assert len(list(iter_sitemap(SITE + "/sitemap.xml.gz", max_bytes=10000))) < 2000
+
+def test_robots_cap(site):
+    site[SITE + "/robots.txt"] = b"Sitemap: https://a.com/pages.xml\n" + b"#" * sitemap.MAX_ROBOTS_BYTES
+    site[SITE + "/pages.xml"] = urlset("https://a.com/privacy")
+    site[SITE + "/sitemap.xml"] = urlset("https://a.com/policies")
+    assert discover_sitemap_links(SITE, UK_KEYWORDS) == ["https://a.com/policies"]
+
+def test_url_cap(site):
+    site[SITE + "/sitemap.xml"] = urlset(*(["https://a.com/page%d" % i for i in range(10)] + ["https://a.com/privacy"]))
+    assert discover_sitemap_links(SITE, UK_KEYWORDS, max_urls=10) == []
+    assert discover_sitemap_links(SITE, UK_KEYWORDS, max_urls=11) == ["https://a.com/privacy"]
+
+def test_link_cap(site):
+    site[SITE + "/sitemap.xml"] = urlset(*(["https://a.com/policies/%d" % i for i in range(5)]
+                                           + ["https://a.com/privacy/%d" % i for i in range(5)]))
+    assert discover_sitemap_links(SITE, UK_KEYWORDS, max_links=3) == ["https://a.com/privacy/0", "https://a.com/privacy/1", "https://a.com/privacy/2"]
+    assert discover_sitemap_links(SITE, UK_KEYWORDS, max_links=7) == (["https://a.com/privacy/%d" % i for i in range(5)]
+                                                                       + ["https://a.com/policies/0", "https://a.com/policies/1"])
+
+def test_ranking(site):
+    site[SITE + "/sitemap.xml"] = urlset("https://a.com/help/contact",
+                                         "https://a.com/legal/cookie-policy",
+                                         "https://a.com/help/privacy-settings",
+                                         "https://a.com/Data_Policy",
+                                         "https://a.com/legal/cookie-policy",
+                                         "https://a.com/privacy")
+    assert discover_sitemap_links(SITE, ["privacy", "help", "data policy", "cookie policy"]) == \
+        ["https://a.com/help/privacy-settings", "https://a.com/privacy", "https://a.com/legal/cookie-policy", "https://a.com/Data_Policy"]
+
+@pytest.mark.parametrize("url, keywords, rank", [
+    ("https://a.com/privacy", UK_KEYWORDS, 0),
+    ("https://a.com/PRIVACY-NOTICE", UK_KEYWORDS, 0),
+    ("https://a.com/policies/terms", UK_KEYWORDS, 1),
+    ("https://a.com/help/centre", UK_KEYWORDS, None),
+    ("https://a.com/help", ["help"], None),
+    ("https://a.com/gdpr", ["privacy", "gdpr"], 1),
+    ("https://a.com/data-policy", ["data policy"], 1),
+    ("https://a.com/privacy", ["cookie policy"], None),
+])
+def test_sitemap_rank(url, keywords, rank):
+    assert sitemap_rank(url, sitemap_patterns(keywords)) == rank
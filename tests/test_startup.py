@@ -0,0 +1,38 @@
+"""
+Privacy Policy Project
+Startup cost of the crawler.  `import crawler` is paid by the parent and
+again by every pool worker, so heavy modules must only load on first use.
+"""
+
+import json, os, subprocess, sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+IMPORT_TIME_BUDGET = 0.5    # seconds, the eager selenium/sklearn/pandas imports took well over a second
+DEFERRED_MODULES = ["selenium", "sklearn", "psutil", "pandas", "numpy"]
+ATTEMPTS = 3                # best of a few runs, so a busy machine doesn't fail the test
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import crawler
+print(json.dumps({"seconds": time.perf_counter() - start,
+                  "modules": sorted(name.split(".")[0] for name in sys.modules)}))
+"""
+
+def import_crawler():
+    """
+    Out:    (seconds taken by `import crawler`, top-level modules loaded),
+            measured in a fresh interpreter
+    """
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=SRC_DIR, check=True,
+                            capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result["seconds"], set(result["modules"])
+
+def test_import_time_budget():
+    seconds = min(import_crawler()[0] for _ in range(ATTEMPTS))
+    assert seconds < IMPORT_TIME_BUDGET, "import crawler took %.3fs" % seconds
+
+def test_heavy_modules_are_deferred():
+    modules = import_crawler()[1]
+    assert [name for name in DEFERRED_MODULES if name in modules] == []
@@ -0,0 +1,53 @@
+"""
+Privacy Policy Project
+Regression tests for the ground truth similarity score, which has to
+keep matching the TfidfVectorizer + cosine_similarity score it replaced.
+"""
+
+import pytest
+from collections import Counter
+from verification.verify import GroundTruth, count_terms, ground_truth_similarity
+
+GROUND_TRUTH = ("Your privacy matters. We collect personal information and share it with third parties. "
+                "Read this privacy policy to learn how we use your personal data.")
+
+# (ground truth text, document text, expected score)
+CASES = [
+    ("privacy data data", "privacy cookies", 0.19431434016858146),
+    ("we collect personal data", "we collect personal data", 1.0),
+    ("privacy policy", "terms of service", 0.0),
+    ("Your privacy matters. We collect personal information and share it with third parties.",
+     "We use cookies to collect information about your visit and share it with partners.", 0.4246632993408622),
+]
+
+@pytest.mark.parametrize("ground_truth_text, document, expected", CASES)
+def test_fixed_scores(ground_truth_text, document, expected):
+    ground_truth = GroundTruth(count_terms(ground_truth_text))
+    assert ground_truth_similarity(ground_truth, document) == pytest.approx(expected)
+
+def test_empty_document():
+    assert ground_truth_similarity(GroundTruth(count_terms(GROUND_TRUTH)), "") == 0.0
+    assert ground_truth_similarity(GroundTruth(count_terms(GROUND_TRUTH)), "a . !") == 0.0
+
+def test_empty_ground_truth():
+    assert ground_truth_similarity(GroundTruth(Counter()), GROUND_TRUTH) == 0.0
+
+@pytest.mark.parametrize("document", [GROUND_TRUTH, GROUND_TRUTH.upper()] + [document for _, document, _ in CASES])
+def test_matches_sklearn(document):
+    sklearn_text = pytest.importorskip("sklearn.feature_extraction.text")
+    sklearn_pairwise = pytest.importorskip("sklearn.metrics.pairwise")
+    tfidf = sklearn_text.TfidfVectorizer().fit_transform([GROUND_TRUTH, document])
+    expected = sklearn_pairwise.cosine_similarity(tfidf[0], tfidf[1])[0][0]
+    assert ground_truth_similarity(GroundTruth(count_terms(GROUND_TRUTH)), document) == pytest.approx(expected)
+
+def test_centroid_matches_sklearn_on_concatenated_corpus():
+    sklearn_text = pytest.importorskip("sklearn.feature_extraction.text")
+    sklearn_pairwise = pytest.importorskip("sklearn.metrics.pairwise")
+    corpus = [GROUND_TRUTH, CASES[3][0], "Cookies and consent: you have rights over the processing of your data."]
+    document = CASES[3][1]
+    counts = Counter()
+    for policy in corpus:
+        counts.update(count_terms(policy))
+    tfidf = sklearn_text.TfidfVectorizer().fit_transform([" ".join(corpus), document])
+    expected = sklearn_pairwise.cosine_similarity(tfidf[0], tfidf[1])[0][0]
+    assert ground_truth_similarity(GroundTruth(counts), document) == pytest.approx(expected)
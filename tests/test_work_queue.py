@@ -0,0 +1,140 @@
+"""
+Privacy Policy Project
+Tests for the SQLite work queue used by distributed crawls.
+"""
+
+import time
+import pytest
+from utils.work_queue import DONE, FAILED, LEASED, PENDING, WorkQueue
+
+DOMAINS = [("a.com", "https://a.com/privacy"), ("b.com", None), ("c.com", None)]
+
+@pytest.fixture
+def work_queue(tmp_path):
+    work_queue = WorkQueue(str(tmp_path / "queue.db"), lease_timeout=60, max_attempts=2)
+    work_queue.load(DOMAINS)
+    return work_queue
+
+def expire_leases(work_queue):
+    conn = work_queue._connect()
+    conn.execute("UPDATE tasks SET lease_expires = ? WHERE state = ?", (time.time() - 1, LEASED))
+
+def test_load_is_idempotent(work_queue):
+    work_queue.load(DOMAINS + [("d.com", None)])
+    assert work_queue.domains() == ["a.com", "b.com", "c.com", "d.com"]
+    assert work_queue.counts() == {PENDING: 4}
+
+def test_loaded_marker(tmp_path):
+    work_queue = WorkQueue(str(tmp_path / "queue.db"))
+    assert not work_queue.loaded()
+    assert work_queue.unfinished() == 0
+    work_queue.load([])
+    assert work_queue.loaded()
+
+def test_lease_hands_out_each_domain_once(work_queue):
+    first = work_queue.lease("w1", batch_size=2)
+    second = work_queue.lease("w2", batch_size=2)
+    assert [row[1] for row in first] == ["a.com", "b.com"]
+    assert [row[1] for row in second] == ["c.com"]
+    assert work_queue.lease("w3", batch_size=2) == []
+    assert work_queue.counts() == {LEASED: 3}
+
+def test_expired_lease_is_reclaimed(work_queue):
+    work_queue.lease("w1", batch_size=3)
+    expire_leases(work_queue)
+    work_queue.reclaim()
+    assert work_queue.counts() == {PENDING: 3}
+    assert len(work_queue.lease("w2", batch_size=3)) == 3
+
+def test_extend_keeps_lease(work_queue):
+    batch = work_queue.lease("w1", batch_size=3)
+    expire_leases(work_queue)
+    work_queue.extend("w1", [row[0] for row in batch])
+    work_queue.reclaim()
+    assert work_queue.counts() == {LEASED: 3}
+
+def test_complete_stores_result(work_queue):
+    task_id, domain, policy, attempt = work_queue.lease("w1", batch_size=1)[0]
+    assert attempt == 1
+    work_queue.complete("w1", task_id, {"domain": domain})
+    assert work_queue.counts()[DONE] == 1
+    assert work_queue.results()[0] == ("a.com", "https://a.com/privacy", {"domain": "a.com"})
+
+def test_stale_owner_cannot_complete(work_queue):
+    task_id = work_queue.lease("w1", batch_size=1)[0][0]
+    expire_leases(work_queue)
+    assert work_queue.lease("w2", batch_size=1)[0][0] == task_id
+    work_queue.complete("w1", task_id, "stale")
+    assert work_queue.results()[0][2] is None
+    work_queue.complete("w2", task_id, "fresh")
+    assert work_queue.results()[0][2] == "fresh"
+
+def test_max_attempts_fails_domain(work_queue):
+    task_id = work_queue.lease("w1", batch_size=1)[0][0]
+    work_queue.fail("w1", task_id)
+    assert work_queue.lease("w2", batch_size=1)[0][0] == task_id
+    expire_leases(work_queue)
+    work_queue.reclaim()
+    counts = work_queue.counts()
+    assert counts[FAILED] == 1 and counts[PENDING] == 2
+    assert work_queue.results()[0][2] is None
+    assert work_queue.unfinished() == 2
+
+def test_shared_fs_uses_rollback_journal(tmp_path):
+    work_queue = WorkQueue(str(tmp_path / "queue.db"), shared_fs=True)
+    assert work_queue._connect().execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+
+def test_fingerprint_dict(work_queue):
+    fingerprints = work_queue.fingerprint_dict("policy")
+    assert "text" not in fingerprints
+    fingerprints["text"] = ["a.com"]
+    assert "text" in fingerprints
+    assert fingerprints["text"] == ["a.com"]
+    assert len(fingerprints) == 1
+    assert len(work_queue.fingerprint_dict("link")) == 0
+
+def test_retry_reports_attempt_number(work_queue):
+    task_id = work_queue.lease("w1", batch_size=1)[0][0]
+    work_queue.fail("w1", task_id)
+    assert work_queue.lease("w2", batch_size=1)[0] == (task_id, "a.com", "https://a.com/privacy", 2)
+
+def test_attempt_fingerprints_published_on_complete(work_queue):
+    links = work_queue.fingerprint_dict("link")
+    links["https://a.com/seen"] = 0
+    task_id = work_queue.lease("w1", batch_size=1)[0][0]
+    attempt = links.attempt()
+    assert "https://a.com/seen" in attempt
+    attempt["https://a.com/new"] = 0
+    assert "https://a.com/new" in attempt and "https://a.com/new" not in links
+    assert len(attempt) == 2
+    assert work_queue.complete("w1", task_id, "result", [attempt])
+    assert "https://a.com/new" in links
+
+def test_failed_attempt_fingerprints_are_dropped(work_queue):
+    links = work_queue.fingerprint_dict("link")
+    task_id = work_queue.lease("w1", batch_size=1)[0][0]
+    attempt = links.attempt()
+    attempt["https://a.com/privacy"] = 0
+    work_queue.fail("w1", task_id)
+    assert work_queue.lease("w2", batch_size=1)[0][0] == task_id
+    assert "https://a.com/privacy" not in links.attempt()
+
+def test_stale_owner_does_not_publish_fingerprints(work_queue):
+    links = work_queue.fingerprint_dict("link")
+    task_id = work_queue.lease("w1", batch_size=1)[0][0]
+    attempt = links.attempt()
+    attempt["https://a.com/privacy"] = 0
+    expire_leases(work_queue)
+    work_queue.lease("w2", batch_size=1)
+    assert not work_queue.complete("w1", task_id, "stale", [attempt])
+    assert len(links) == 0
+
+def test_connections_are_per_thread(work_queue):
+    import threading
+    batch = work_queue.lease("w1", batch_size=3)
+    expire_leases(work_queue)
+    thread = threading.Thread(target=work_queue.extend, args=("w1", [row[0] for row in batch]))
+    thread.start()
+    thread.join()
+    work_queue.reclaim()
+    assert work_queue.counts() == {LEASED: 3}